@@ -0,0 +1,77 @@
+"""
+Headless move choosers working directly on tafl_engine positions.
+
+These are the pygame-free cores of the model driven computer players:
+hnefatafl_train wraps them for the sprite game, and the self-play workers
+call them directly. The random player lives in tafl_engine.random_move.
+"""
+
+import numpy as np
+import torch
+import tafl_engine as engine
+
+
+def state_to_array(state, out=None):
+    """2D Numpy array representation of a tafl_engine.State for ML model.
+
+    Attackers are 1, defenders -1 and the king -2, indexed [x_tile][y_tile].
+
+    Args:
+        state (State): the position
+        out (np.ndarray): optional float32 array of 121 elements to fill
+
+    Returns:
+        arr (np.ndarray): 11x11 float32 array
+    """
+    if out is None:
+        arr = np.zeros(engine.NUM_SQUARES, dtype=np.float32)
+    else:
+        arr = out.reshape(engine.NUM_SQUARES)
+        arr[:] = 0.0
+
+    for sq in engine.iter_bits(state.attackers):
+        arr[sq] = 1.0
+    for sq in engine.iter_bits(state.defenders):
+        arr[sq] = -1.0
+    for sq in engine.iter_bits(state.king):
+        arr[sq] = -2.0
+
+    return arr.reshape((engine.DIM, engine.DIM))
+
+
+def children_batch(state, moves):
+    """Stack the positions after each move into one [N, 1, 11, 11] array."""
+    children = np.empty((len(moves), 1, engine.DIM, engine.DIM),
+                        dtype=np.float32)
+    for i, m in enumerate(moves):
+        # Make the candidate move, captures included, then take it back
+        engine.apply(state, m)
+        state_to_array(state, children[i, 0])
+        engine.undo(state, m)
+    return children
+
+
+def value_move(state, model, tablebase=None):
+    """Pick the move whose child position the model scores highest.
+
+    All children are scored in a single batched forward pass. Positions
+    covered by the tablebase are played from it instead.
+
+    Args:
+        state (State): the position, side to move included
+        model (HingstonNetwork): scores child positions
+        tablebase (Tablebase): optional endgame tables to consult first
+
+    Returns:
+        move ((int, int)): the best legal move, or None if there is none
+    """
+    if tablebase is not None:
+        m = tablebase.best_move(state)
+        if m is not None:
+            return m
+    moves = engine.cached_moves(state)
+    if not moves:
+        return None
+    with torch.inference_mode():
+        scores = model(torch.from_numpy(children_batch(state, moves)))
+    return moves[int(torch.argmax(scores.reshape(-1)))]
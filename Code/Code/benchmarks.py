@@ -0,0 +1,336 @@
+"""
+Benchmarks of the rules, the heuristics and the network.
+
+Runs headless on three fixed positions (the opening, a middlegame and an
+endgame, below) and times the paths the game loops and agents spend their
+time in: Move.valid_moves for every piece of the side to move, complete
+moves through Move.remove_pieces, Simple_heuristic and its incremental
+evaluation.Evaluator (one position, and all children at once),
+game_state_to_array, tafl_engine.legal_moves and HingstonNetwork forward
+passes. Every benchmark reports operations per second (best of a few
+repeats) and, from a separate run under tracemalloc, the memory blocks each
+operation leaves allocated (caches and leaks) and the peak bytes it
+allocates. tracemalloc only sees Python allocations, so tensor storage is
+not counted. Results are written as JSON, and a previous JSON file can be
+given to list the benchmarks that got slower. Run it as
+
+    python benchmarks.py [OUT] [BASELINE]
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import torch
+import pygame
+import hnefatafl as tafl
+import tafl_engine as engine
+import tools as tool
+import agents
+import evaluation
+import hnefatafl_train as ht
+import value_net as vn
+
+OUT_PATH = "benchmarks.json"
+REPEATS = 5
+# Seconds one repeat should last at least
+MIN_TIME = 0.2
+ALLOC_RUNS = 20
+# Slowdown, as a share of the baseline rate, reported as a regression
+TOLERANCE = 0.1
+SEED = 0
+
+# Positions reached by capture-biased random play (see check_rules), fixed
+# here so the numbers do not move when the engine changes
+MIDDLEGAME_GRID = ("...aaaaad..",
+                   ".....d.....",
+                   ".....c.....",
+                   "a.d...d...a",
+                   "....d.d...a",
+                   "aa.d......a",
+                   "...........",
+                   "a....dd..a.",
+                   "......a.a..",
+                   "...a......a",
+                   "..a..a.....")
+ENDGAME_GRID = ("........a..",
+                "....a.d....",
+                "c.a........",
+                "...........",
+                ".a..d.....a",
+                "a..........",
+                "...........",
+                "a....aa....",
+                "..........d",
+                ".....a.....",
+                "..a........")
+POSITIONS = (("opening", engine.START_GRID, True),
+             ("middlegame", MIDDLEGAME_GRID, True),
+             ("endgame", ENDGAME_GRID, False))
+
+
+def set_up(grid, a_turn):
+    """Put the pieces of grid on the sprites.
+
+    Returns:
+        (Move): a Move with the side to move set
+    """
+    tool.initialize_groups()
+    board = tafl.Board()
+    board.grid = list(grid)
+    tool.initialize_pieces(board)
+    move = tafl.Move()
+    move.a_turn = a_turn
+    move.board_squares()
+    return move
+
+
+def bench_valid_moves(move):
+    """Select every piece of the side to move, with a cold move cache."""
+    pieces = list(tafl.Attackers if move.a_turn else tafl.Defenders)
+
+    def run():
+        engine.MOVE_CACHE.clear()
+        for piece in pieces:
+            move.row, move.col = piece.x_tile, piece.y_tile
+            move.valid_moves(piece.special_sqs)
+    return run
+
+
+def bench_sprite_valid_moves(move):
+    """The collision based generation, for comparison with valid_moves."""
+    pieces = list(tafl.Attackers if move.a_turn else tafl.Defenders)
+
+    def run():
+        for piece in pieces:
+            move.row, move.col = piece.x_tile, piece.y_tile
+            move.sprite_valid_moves(piece.special_sqs)
+    return run
+
+
+def bench_remove_pieces(move):
+    """Look for captures after every legal move of a soldier.
+
+    Each move is made on the square lookup only, remove_pieces is run and
+    the board is put back, so the sprites end where they started.
+    """
+    state = tool.engine_state(move)
+    king = state.king_sq
+    moves = [m for m in engine.legal_moves(state) if m[0] != king]
+    if move.a_turn:
+        groups = (tafl.Defenders, tafl.Attackers, tafl.Kings)
+    else:
+        groups = (tafl.Attackers, tafl.Defenders, tafl.Kings)
+
+    def run():
+        for frm, to in moves:
+            move._place(to, move._lift(frm))
+            move.row, move.col = engine.coords(to)
+            for p, owners in move.remove_pieces(*groups):
+                p.add(*owners)
+            move._place(frm, move._lift(to))
+        move.king_killed = move.game_over = False
+    return run
+
+
+def bench_legal_moves(move):
+    state = tool.engine_state(move)
+    return lambda: engine.legal_moves(state)
+
+
+def bench_game_state_to_array(move):
+    return ht.game_state_to_array
+
+
+def bench_state_to_array(move):
+    state = tool.engine_state(move)
+    out = np.zeros((engine.DIM, engine.DIM), dtype=np.float32)
+    return lambda: agents.state_to_array(state, out)
+
+
+def bench_simple_heuristic(move):
+    game_state = ht.game_state_to_array()
+    defender = not move.a_turn
+    return lambda: ht.Simple_heuristic(game_state, defender)
+
+
+def bench_evaluator(move):
+    """Score one position with evaluation.Evaluator, for Simple_heuristic."""
+    evaluator = evaluation.Evaluator(tool.engine_state(move))
+    defender = not move.a_turn
+    return lambda: evaluator.evaluate(defender)
+
+
+def bench_children_scores(move):
+    """Score every child at once, as Hingston_Simple_Agent does."""
+    state = tool.engine_state(move)
+    evaluator = evaluation.Evaluator(state)
+    moves = engine.legal_moves(state)
+    defender = not move.a_turn
+    return lambda: evaluator.children_scores(
+        *evaluation.move_arrays(state, moves), defender=defender)
+
+
+def _forward(model, batch):
+    x = torch.from_numpy(batch)
+
+    def run():
+        with torch.inference_mode():
+            model(x)
+    return run
+
+
+def bench_forward(move):
+    """One position through HingstonNetwork."""
+    model = vn.HingstonNetwork()
+    model.eval()
+    batch = agents.state_to_array(tool.engine_state(move))[None, None]
+    return _forward(model, batch)
+
+
+def bench_forward_children(move):
+    """Every child position in one batch, as agents.value_move does."""
+    model = vn.HingstonNetwork(fused=True)
+    model.eval()
+    state = tool.engine_state(move)
+    return _forward(model, agents.children_batch(state,
+                                                 engine.legal_moves(state)))
+
+
+BENCHMARKS = (("valid_moves", bench_valid_moves),
+              ("sprite_valid_moves", bench_sprite_valid_moves),
+              ("remove_pieces", bench_remove_pieces),
+              ("legal_moves", bench_legal_moves),
+              ("game_state_to_array", bench_game_state_to_array),
+              ("state_to_array", bench_state_to_array),
+              ("Simple_heuristic", bench_simple_heuristic),
+              ("Evaluator", bench_evaluator),
+              ("children_scores", bench_children_scores),
+              ("forward", bench_forward),
+              ("forward_children", bench_forward_children))
+
+
+def ops_per_second(run):
+    """Best rate of REPEATS timings lasting MIN_TIME or more."""
+    timer = timeit.Timer(run)
+    number = 1
+    while timer.timeit(number) < MIN_TIME:
+        number *= 2
+    return number / min(timer.repeat(REPEATS, number))
+
+
+def allocations(run):
+    """Memory blocks kept and peak bytes traced per run.
+
+    Blocks are counted with tracemalloc snapshots, so blocks allocated and
+    freed within a run are not seen; the peak shows their size.
+
+    Returns:
+        (float, float): blocks still allocated after each run, on average,
+                        and the peak traced size of one run in bytes
+    """
+    run()  # warm up caches that are only filled once
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(ALLOC_RUNS):
+            run()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        run()
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    blocks = sum(s.count_diff for s in after.filter_traces(ignore).compare_to(
+        before.filter_traces(ignore), "filename"))
+    return blocks / ALLOC_RUNS, peak
+
+
+def run_benchmarks(names=None):
+    """Run the benchmarks (all of them, or those in names) on every position.
+
+    Returns:
+        (list(dict)): one entry per benchmark and position
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    torch.manual_seed(SEED)
+    torch.set_num_threads(1)
+    results = []
+    for position, grid, a_turn in POSITIONS:
+        for name, bench in BENCHMARKS:
+            if names and name not in names:
+                continue
+            move = set_up(grid, a_turn)
+            run = bench(move)
+            blocks, peak = allocations(run)
+            results.append({"name": name,
+                            "position": position,
+                            "ops_per_second": ops_per_second(run),
+                            "retained_blocks": blocks,
+                            "peak_bytes": peak})
+            tool.cleanup()
+    return results
+
+
+def environment():
+    return {"python": platform.python_version(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f,
+                  indent=1)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def regressions(baseline, results, tolerance=TOLERANCE):
+    """Benchmarks whose rate dropped by more than tolerance.
+
+    Returns:
+        (list((str, str, float))): name, position and new / old rate
+    """
+    old = dict(((r["name"], r["position"]), r["ops_per_second"])
+               for r in baseline)
+    slower = []
+    for r in results:
+        key = (r["name"], r["position"])
+        if key in old and r["ops_per_second"] < (1 - tolerance) * old[key]:
+            slower.append(key + (r["ops_per_second"] / old[key],))
+    return slower
+
+
+def main():
+    out = sys.argv[1] if len(sys.argv) > 1 else OUT_PATH
+    results = run_benchmarks()
+    for r in results:
+        print("{:<20} {:<11} {:>12.0f} ops/s {:>8.1f} blocks {:>9} bytes"
+              .format(r["name"], r["position"], r["ops_per_second"],
+                      r["retained_blocks"], r["peak_bytes"]))
+    save_results(out, results)
+    print("results written to {}".format(out))
+    if len(sys.argv) > 2:
+        slower = regressions(load_results(sys.argv[2]), results)
+        for name, position, ratio in slower:
+            print("slower: {} on the {} ({:.0%} of baseline)".format(
+                name, position, ratio))
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
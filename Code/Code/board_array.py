@@ -0,0 +1,92 @@
+"""
+Incrementally updated NumPy board.
+
+ArrayBoard is the authoritative array form of a position during a game: an
+int8 11x11 array (attackers 1, defenders -1, king -2, indexed
+[x_tile][y_tile] like agents.state_to_array) that is changed in place by
+each move and capture instead of being rebuilt every ply. A float32 mirror
+receives the same writes, and its views are what the value network reads,
+so no conversion is needed to build a model input.
+"""
+
+import numpy as np
+import tafl_engine as engine
+
+ATTACKER, DEFENDER, KING = 1, -1, -2
+
+
+class ArrayBoard(object):
+    """int8 board plus a float32 mirror, both updated in place."""
+
+    def __init__(self, state=None):
+        """Create the board, empty or from a tafl_engine.State."""
+        self.cells = np.zeros((engine.DIM, engine.DIM), dtype=np.int8)
+        self.network_input = np.zeros((1, 1, engine.DIM, engine.DIM),
+                                      dtype=np.float32)
+        self._cells = self.cells.reshape(-1)
+        self._floats = self.network_input.reshape(-1)
+        self.history = []
+        if state is not None:
+            self.load(state)
+
+    def load(self, state):
+        """Reset the board to a tafl_engine.State."""
+        self._cells[:] = 0
+        for sq in engine.iter_bits(state.attackers):
+            self._cells[sq] = ATTACKER
+        for sq in engine.iter_bits(state.defenders):
+            self._cells[sq] = DEFENDER
+        for sq in engine.iter_bits(state.king):
+            self._cells[sq] = KING
+        self._floats[:] = self._cells
+        self.history = []
+
+    def as_float(self):
+        """Return the 11x11 float32 view of the board (no copy)."""
+        return self.network_input[0, 0]
+
+    def push(self, move, captured=0):
+        """Play a move and its captures in place.
+
+        Args:
+            move ((int, int)): (from, to) bit indices
+            captured (int): bitboard of the captured pieces, as recorded by
+                            tafl_engine.apply
+        """
+        frm, to = move
+        cells, floats = self._cells, self._floats
+        piece = cells[frm]
+        cells[frm] = 0
+        floats[frm] = 0.0
+        cells[to] = piece
+        floats[to] = piece
+        victim = 0
+        for sq in engine.iter_bits(captured):
+            victim = cells[sq]
+            cells[sq] = 0
+            floats[sq] = 0.0
+        self.history.append((move, captured, victim))
+
+    def pop(self):
+        """Take back the last push.
+
+        Returns:
+            move ((int, int)): the move taken back
+        """
+        move, captured, victim = self.history.pop()
+        frm, to = move
+        cells, floats = self._cells, self._floats
+        piece = cells[to]
+        cells[to] = 0
+        floats[to] = 0.0
+        cells[frm] = piece
+        floats[frm] = piece
+        for sq in engine.iter_bits(captured):
+            cells[sq] = victim
+            floats[sq] = victim
+        return move
+
+    def push_last(self, state):
+        """Mirror the last tafl_engine.apply done on state."""
+        move, captured = state.history[-1][:2]
+        self.push(move, captured)
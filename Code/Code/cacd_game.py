@@ -12,17 +12,29 @@ Date: 3/15/2024
 import pygame
 import tools as tool
 import hnefatafl as tafl
+import tafl_search as search
+import transposition
+import opening_book
 import sys
 import random
 from pygame.locals import *
 
 
-def run_cacd_game(screen=None):
+def run_cacd_game(screen=None, searcher=None, writer=None):
     """Start and run one game of computer vs computer hnefatafl.
 
     TODO: Add description
 
+    Args:
+        screen (pygame.Surface): The game window, None to run headless
+        searcher (Searcher): the search used by both players, defaults to
+                             a tafl_search.Searcher with a transposition
+                             table and the opening book, if one was built
+        writer (GameWriter): records the game, None to not keep it
     """
+    if searcher is None:
+        searcher = search.Searcher(table=transposition.TranspositionTable(),
+                                   book=opening_book.open_book())
     board = tafl.Board()
     move = tafl.Move()
     tool.initialize_pieces(board)
@@ -42,31 +54,39 @@ def run_cacd_game(screen=None):
         num_moves += 1
         if num_moves >= 1000:
             print("Draw game after {} moves".format(num_moves))
+            if writer is not None:
+                writer.finish(0)
             a_predicted_scores.append(0.0)
             d_predicted_scores.append(0.0)
             return a_game_states, a_predicted_scores[1:], d_game_states, d_predicted_scores[
                                                                          1:]  # i.e. the corrected scores from RL
 
         if move.a_turn:
-            game_state = tool.do_random_move(move)
+            game_state = tool.do_search_move(move, searcher)
             predicted_score = (random.random() - 0.5) * 2
             a_game_states.append(game_state)
             a_predicted_scores.append(predicted_score)
         else:
-            game_state = tool.do_random_move(move)
+            game_state = tool.do_search_move(move, searcher)
             predicted_score = (random.random() - 0.5) * 2
             d_game_states.append(game_state)
             d_predicted_scores.append(predicted_score)
+        if writer is not None:
+            tool.record_moves(writer, move)
 
         """Text to display on bottom of game."""
         if move.escaped:
             print("King escaped! Defenders win!")
+            if writer is not None:
+                writer.finish(-1)
             a_predicted_scores.append(-1.0)
             d_predicted_scores.append(+1.0)
             return a_game_states, a_predicted_scores[1:], d_game_states, d_predicted_scores[
                                                                          1:]  # i.e. the corrected scores from RL
         if move.king_killed:
             print("King killed! Attackers win!")
+            if writer is not None:
+                writer.finish(1)
             # print(a_predicted_scores[-1])
             a_predicted_scores.append(+1.0)
             d_predicted_scores.append(-1.0)
@@ -74,7 +94,6 @@ def run_cacd_game(screen=None):
                                                                          1:]  # i.e. the corrected scores from RL
         if screen is not None:
             tool.update_image(screen, board, "")
-            pygame.display.update()
 
 
 def main():
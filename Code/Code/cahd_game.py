@@ -14,10 +14,13 @@ from pygame.locals import *
 import sys
 import tools as tool
 import hnefatafl as tafl
+import tafl_search as search
+import transposition
+import opening_book
 import random
 
 
-def run_cahd_game(screen):
+def run_cahd_game(screen, searcher=None):
     """Start and run a new game of hnefatafl.
 
     The game, groups, board, move info, screen, and pieces are initialized
@@ -36,16 +39,23 @@ def run_cahd_game(screen):
 
     Args:
         screen (pygame.Surface): The game window
+        searcher (Searcher): the search used by the computer player,
+                             defaults to a tafl_search.Searcher with a
+                             transposition table and the opening book, if
+                             one was built
 
     Returns:
         True if players want a new game, False o.w.
     """
+    if searcher is None:
+        searcher = search.Searcher(table=transposition.TranspositionTable(),
+                                   book=opening_book.open_book())
     board = tafl.Board()
     move = tafl.Move()
     tool.initialize_pieces(board)
     while 1:
         if move.a_turn and not move.game_over:
-            tool.do_random_move(move)
+            tool.do_search_move(move, searcher)
         else:
             for event in pygame.event.get():
                 if event.type == QUIT:
@@ -77,10 +87,7 @@ def run_cahd_game(screen):
                             move.select(tafl.Current.sprites()[0])
                             tafl.Current.empty()
                         elif move.is_valid_move(pos, tafl.Current.sprites()[0]):
-                            if tafl.Current.sprites()[0] in tafl.Kings:
-                                move.king_escaped(tafl.Kings)
-                            move.remove_pieces(tafl.Attackers, tafl.Defenders, tafl.Kings)
-                            move.end_turn(tafl.Current.sprites()[0])
+                            move.complete_move(tafl.Current.sprites()[0])
                             tafl.Current.empty()
 
         """Text to display on bottom of game."""
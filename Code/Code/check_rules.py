@@ -0,0 +1,142 @@
+"""
+Regression check of the lookup table rules against the sprite rules.
+
+Random games are played on the pygame sprites. At every ply the move
+generation of Move.valid_moves is compared with Move.sprite_valid_moves, and
+the captures made by Move.remove_pieces (through complete_move) with the
+original group scan in Move.sprite_captures; the square lookup and the
+engine position kept by Move are compared with the sprite groups. Moves that
+capture are preferred so that sandwiches and king kills come up often. Run it
+as
+
+    python check_rules.py [games] [seed]
+"""
+
+import os
+import random
+import sys
+import pygame
+import hnefatafl as tafl
+import tafl_engine as engine
+import tools as tool
+
+CAPTURE_BIAS = 0.8
+
+
+def pick_move(state, rng):
+    """Pick a capturing move most of the time, a random one otherwise."""
+    moves = engine.legal_moves(state)
+    if not moves:
+        return None
+    if rng.random() < CAPTURE_BIAS:
+        capturing = [m for m in moves if any(engine.move_captures(state, m))]
+        if capturing:
+            return rng.choice(capturing)
+    return rng.choice(moves)
+
+
+def check_ply(move, m):
+    """Play engine move m on the sprites, comparing both rule sets.
+
+    Returns:
+        (list(str)): descriptions of the differences found
+    """
+    errors = []
+    if move.a_turn:
+        own, other = tafl.Attackers, tafl.Defenders
+    else:
+        own, other = tafl.Defenders, tafl.Attackers
+    piece = tool.piece_at(own, m[0])
+    move.select(piece)
+    reference = move.sprite_valid_moves(piece.special_sqs)
+    if move.vm != reference:
+        errors.append("valid moves of {}: {} != {}".format(
+            move.start, sorted(move.vm), sorted(reference)))
+    if not move.is_valid_move(engine.coords(m[1]), piece, True):
+        errors.append("engine move {} rejected".format(m))
+        return errors
+    expected, king_killed = move.sprite_captures(other, own, tafl.Kings)
+    move.complete_move(piece)
+    captured = [p for p, groups in move.history[-1][-1]]
+    if set(captured) != set(expected):
+        errors.append("captures of {}: {} != {}".format(
+            m, [(p.x_tile, p.y_tile) for p in captured],
+            [(p.x_tile, p.y_tile) for p in expected]))
+    if move.king_killed != king_killed:
+        errors.append("king killed by {}: {} != {}".format(
+            m, move.king_killed, king_killed))
+    return errors
+
+
+def check_squares(move):
+    """Compare the board_squares lookup with the sprite groups."""
+    expected = dict((engine.square(p.x_tile, p.y_tile), p)
+                    for p in tafl.Pieces)
+    if move.squares != expected:
+        return ["square lookup out of date"]
+    occupied = 0
+    for sq in expected:
+        occupied |= engine.BIT[sq]
+    if move.occupied != occupied:
+        return ["occupancy out of date"]
+    state = tool.sprite_state(move)
+    position = move.position
+    if move.king_killed:
+        # The engine leaves a killed king on its square
+        state.king = position.king
+    if ((position.attackers, position.defenders, position.king,
+         position.a_turn) != (state.attackers, state.defenders, state.king,
+                              state.a_turn)):
+        return ["engine position out of date"]
+    return []
+
+
+def check_game(rng, max_moves=400):
+    """Play one game, taking a move back now and then.
+
+    Returns:
+        (int, bool, list(str)): plies checked, whether the king was killed
+                                and the differences found
+    """
+    tool.initialize_groups()
+    board = tafl.Board()
+    move = tafl.Move()
+    tool.initialize_pieces(board)
+    plies = 0
+    errors = []
+    while not move.game_over and plies < max_moves and not errors:
+        m = pick_move(tool.engine_state(move), rng)
+        if m is None:
+            break
+        errors += check_ply(move, m)
+        plies += 1
+        if not move.game_over and rng.random() < 0.05:
+            move.unmake()
+        errors += check_squares(move)
+    tool.cleanup()
+    return plies, move.king_killed, errors
+
+
+def main():
+    """Check a number of random games and report any difference."""
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    rng = random.Random(seed)
+    plies = kills = 0
+    for i in range(games):
+        n, killed, errors = check_game(rng)
+        plies += n
+        kills += killed
+        if errors:
+            print("game {}:".format(i))
+            for e in errors:
+                print("  " + e)
+            sys.exit(1)
+    print("{} games, {} plies, {} king kills: no differences".format(
+        games, plies, kills))
+
+
+if __name__ == '__main__':
+    main()
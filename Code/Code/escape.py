@@ -0,0 +1,306 @@
+"""
+King escape analysis.
+
+Works out how far pieces are from a corner in straight slides. The squares
+with a clear line to a corner are found in one pass by sliding outwards from
+the four corners, and the squares two slides away by sliding outwards from
+those, so the king and every defender are classified together instead of
+one loop per piece. moves_to_escape of a defender is the number of slides
+the king would need from that square, which is how far that defender is
+from opening or using an escape route.
+
+The full distance field (the number of king slides from every square to
+the nearest corner) is a breadth-first search from the corners where each
+level slides the whole frontier at once with bitboard shifts. Fields are
+kept per occupancy (without the king) in an LRU cache, so king moves and
+positions that come back in a search reuse them. A field that is not
+cached is updated from the last one looked up: the search restarts from
+the first ring the difference in occupancy can change.
+"""
+
+import collections
+import numpy as np
+import tafl_engine as engine
+
+FULL_MASK = (1 << engine.NUM_SQUARES) - 1
+
+
+def _column(y):
+    bb = 0
+    for x in range(engine.DIM):
+        bb |= engine.BIT[engine.square(x, y)]
+    return bb
+
+
+# (shift, mask) of one step in each direction; the masks drop bits that
+# would wrap around to the other edge of the board
+STEPS = ((1, FULL_MASK & ~_column(0)), (-1, FULL_MASK & ~_column(10)),
+         (engine.DIM, FULL_MASK), (-engine.DIM, FULL_MASK))
+
+
+def reach(occupied, sq):
+    """Squares a slide from sq passes over, plus the first piece on each ray."""
+    hits = 0
+    for rays, forward in engine.RAY_TABLES:
+        ray = rays[sq]
+        blockers = ray & occupied
+        if blockers:
+            if forward:
+                b = (blockers & -blockers).bit_length() - 1
+            else:
+                b = blockers.bit_length() - 1
+            ray ^= rays[b]
+        hits |= ray
+    return hits
+
+
+def escape_map(occupied):
+    """Classify every square by its distance to a corner in slides.
+
+    Args:
+        occupied (int): bitboard of all pieces
+
+    Returns:
+        (int, int): bitboards of the squares with a clear line to a corner
+                    (one slide), and of the further squares that have a clear
+                    line to an empty square of the first kind (two slides).
+    """
+    one = 0
+    for corner in engine.CORNERS:
+        one |= reach(occupied, corner)
+    two = 0
+    for sq in engine.iter_bits(one & ~occupied & ~engine.CORNER_MASK):
+        two |= reach(occupied, sq)
+    return one, two & ~one
+
+
+def slides(sources, empty):
+    """Squares reached by one slide from any square of sources.
+
+    Args:
+        sources (int): bitboard of the squares to slide from
+        empty (int): bitboard of the squares a slide may pass and stop on
+
+    Returns:
+        (int): bitboard of the squares reached
+    """
+    reached = 0
+    for shift, mask in STEPS:
+        bb = sources
+        while True:
+            if shift > 0:
+                bb = (bb << shift) & mask & empty
+            else:
+                bb = (bb >> -shift) & mask & empty
+            if not bb:
+                break
+            reached |= bb
+    return reached
+
+
+def distance_rings(occupied):
+    """King slides to the nearest corner from every square.
+
+    Args:
+        occupied (int): bitboard of the pieces other than the king
+
+    Returns:
+        rings (tuple(int)): rings[d] is the bitboard of the squares d slides
+                            from a corner; squares in no ring can not reach
+                            one
+    """
+    empty = FULL_MASK & ~occupied
+    return _extend([engine.CORNER_MASK & empty], empty)
+
+
+def _extend(rings, empty):
+    """Carry on the search of distance_rings from its last ring so far."""
+    seen = 0
+    for ring in rings:
+        seen |= ring
+    frontier = rings[-1]
+    while True:
+        frontier = slides(frontier, empty) & ~seen
+        if not frontier:
+            return tuple(rings)
+        rings.append(frontier)
+        seen |= frontier
+
+
+def update(rings, occupied, freed, filled):
+    """distance_rings after pieces left freed and arrived on filled.
+
+    Only the rings from the first one the change touches are searched
+    again. A filled square is on no slide to a nearer square, so the rings
+    before its own are kept; a freed square can only be reached from a ring
+    square next to it, at that square's distance or more. When no ring is
+    touched the old rings are returned as they are.
+
+    Args:
+        rings (tuple(int)): distance_rings before the change
+        occupied (int): occupancy after the change, king excluded
+        freed (int): bitboard of the squares emptied
+        filled (int): bitboard of the squares newly occupied
+
+    Returns:
+        rings (tuple(int)): distance_rings(occupied)
+    """
+    near = 0
+    for sq in engine.iter_bits(freed):
+        near |= engine.NEIGHBOURS[sq]
+    for d, ring in enumerate(rings):
+        if ring & filled:
+            return _extend(list(rings[:d]), FULL_MASK & ~occupied)
+        if ring & near:
+            return _extend(list(rings[:max(d, 1)]), FULL_MASK & ~occupied)
+    return rings
+
+
+def ring_distance(rings, sq):
+    """Distance of sq in distance_rings, None if it can not reach a corner."""
+    b = engine.BIT[sq]
+    for d, ring in enumerate(rings):
+        if ring & b:
+            return d
+    return None
+
+
+class DistanceFields(object):
+    """distance_rings of recent occupancies, with LRU eviction.
+
+    A miss is not searched from scratch: the rings returned last are
+    carried over to the new occupancy by update, which in a search is a
+    move or two away.
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.last = None
+        self.hits = 0
+        self.misses = 0
+
+    def rings(self, occupied):
+        """Return distance_rings(occupied), from the cache when possible."""
+        rings = self.entries.get(occupied)
+        if rings is not None:
+            self.entries.move_to_end(occupied)
+            self.hits += 1
+        else:
+            self.misses += 1
+            if self.last is None:
+                rings = distance_rings(occupied)
+            else:
+                last_occupied, last_rings = self.last
+                rings = update(last_rings, occupied,
+                               last_occupied & ~occupied,
+                               occupied & ~last_occupied)
+            self.entries[occupied] = rings
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        self.last = (occupied, rings)
+        return rings
+
+    def clear(self):
+        self.entries.clear()
+        self.last = None
+        self.hits = 0
+        self.misses = 0
+
+
+# Shared by the evaluation and the search
+DISTANCE_FIELDS = DistanceFields()
+
+
+def king_distance(state):
+    """Slides the king needs to reach a corner, None if it is walled in."""
+    rings = DISTANCE_FIELDS.rings(state.occupied & ~state.king)
+    return ring_distance(rings, state.king_sq)
+
+
+def distance_plane(state):
+    """11x11 float32 array of king slides to a corner, -1 where none."""
+    plane = np.full(engine.NUM_SQUARES, -1.0, dtype=np.float32)
+    rings = DISTANCE_FIELDS.rings(state.occupied & ~state.king)
+    for d, ring in enumerate(rings):
+        for sq in engine.iter_bits(ring):
+            plane[sq] = d
+    return plane.reshape((engine.DIM, engine.DIM))
+
+
+def king_escape_moves(state):
+    """Slides the king needs to reach a corner: 0, 1, 2 or None for more."""
+    sq = state.king_sq
+    if state.king & engine.CORNER_MASK:
+        return 0
+    occupied = state.occupied & ~state.king
+    dest = engine.destinations(occupied, sq, True)
+    if dest & engine.CORNER_MASK:
+        return 1
+    for to in engine.iter_bits(dest):
+        if engine.destinations(occupied, to, True) & engine.CORNER_MASK:
+            return 2
+    return None
+
+
+def escape_routes(state):
+    """Number of corners the king can reach with its next slide."""
+    dest = engine.destinations(state.occupied, state.king_sq, True)
+    return engine.popcount(dest & engine.CORNER_MASK)
+
+
+def escape_features(state):
+    """Escape features of the king and every defender in one pass.
+
+    Returns:
+        (dict): king_moves (king_escape_moves), king_routes (escape_routes),
+                defenders_one and defenders_two (number of defenders one and
+                two slides from a corner), and the one/two bitboards of
+                escape_map.
+    """
+    one, two = escape_map(state.occupied)
+    return {"king_moves": king_escape_moves(state),
+            "king_routes": escape_routes(state),
+            "defenders_one": engine.popcount(state.defenders & one),
+            "defenders_two": engine.popcount(state.defenders & two),
+            "one": one,
+            "two": two}
+
+
+def escape_plane(state):
+    """11x11 float32 array: 1 one slide from a corner, 0.5 two, 0 otherwise.
+
+    Can be stacked with agents.state_to_array as an extra network input.
+    """
+    one, two = escape_map(state.occupied)
+    plane = np.zeros(engine.NUM_SQUARES, dtype=np.float32)
+    for sq in engine.iter_bits(one):
+        plane[sq] = 1.0
+    for sq in engine.iter_bits(two):
+        plane[sq] = 0.5
+    return plane.reshape((engine.DIM, engine.DIM))
+
+
+def king_can_escape_array(game_state):
+    """Vectorized check of a clear line from the king to a corner.
+
+    Args:
+        game_state (np.ndarray): 11x11 board with the king as -2
+
+    Returns:
+        bool: True if the king is on an edge with nothing between it and a
+              corner along that edge.
+    """
+    x, y = divmod(int(np.argmin(game_state)), engine.DIM)
+    if game_state[x, y] != -2:
+        return False
+    last = engine.DIM - 1
+    if x == 0 or x == last:
+        row = game_state[x]
+        if not row[:y].any() or not row[y + 1:].any():
+            return True
+    if y == 0 or y == last:
+        col = game_state[:, y]
+        if not col[:x].any() or not col[x + 1:].any():
+            return True
+    return False
@@ -0,0 +1,362 @@
+"""
+Incrementally updated heuristic evaluation.
+
+Evaluator scores positions like hnefatafl_train.Simple_heuristic (material
+plus the king's distance to the nearest corner) without looking at the
+board: the piece counts, the king square and a piece-square table score are
+kept up to date by each move and capture, the same way board_array keeps
+its array, so a position is scored in O(1). All the children of a position
+can also be scored at once: move_arrays turns the legal moves into from,
+to and capture mask arrays, and Evaluator.children_scores returns the score
+of every child as one NumPy vector, so a greedy player is a single argmax.
+
+The piece-square tables hold, for attackers, defenders and the king, a
+value per square for the attackers' side. They are fitted from game
+records by ridge regression of the game result on the piece placement of
+every position (see fit_tables) and are stored as .npy. Without tables the
+score is exactly Simple_heuristic.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import tafl_engine as engine
+import game_record
+import playout
+
+TABLES_PATH = "piece_square.npy"
+ATTACKER, DEFENDER, KING = 0, 1, 2
+NUM_KINDS = 3
+NUM_FEATURES = NUM_KINDS * engine.NUM_SQUARES
+NUM_ATTACKERS = 24
+# Simple_heuristic counts captured defenders from 13, king included
+NUM_DEFENDERS = 13
+DISTANCE_WEIGHT = 0.1
+RIDGE = 10.0
+FIT_BATCH = 4096
+
+
+def _corner_distances():
+    distances = []
+    for sq in range(engine.NUM_SQUARES):
+        x, y = engine.coords(sq)
+        distances.append(min(x + y, 20 - x - y, x + 10 - y, y + 10 - x))
+    return tuple(distances)
+
+
+# Manhattan distance from each square to the nearest corner
+CORNER_DISTANCE = _corner_distances()
+_CORNER_DISTANCE = np.array(CORNER_DISTANCE, dtype=np.float64)
+# Cell codes of move_arrays beyond the piece kinds; the board has the
+# always-blocked square playout.OFF that neighbours past the edge point to
+EMPTY, WALL = 3, 4
+
+
+def board_cells(state):
+    """Piece kind per square of a position, [122] int8 (EMPTY, WALL at OFF)."""
+    cells = np.full(playout.ROW, EMPTY, dtype=np.int8)
+    cells[playout.OFF] = WALL
+    for kind, bb in ((ATTACKER, state.attackers),
+                     (DEFENDER, state.defenders), (KING, state.king)):
+        for sq in engine.iter_bits(bb):
+            cells[sq] = kind
+    return cells
+
+
+def move_arrays(state, moves):
+    """Describe moves of a position as arrays, captures included.
+
+    Captures are found for all moves at once with the playout neighbour
+    tables, following tafl_engine.board_captures (a soldier between the
+    mover and a friendly piece or an empty special square).
+
+    Args:
+        state (State): the position
+        moves (sequence((int, int))): legal moves, e.g.
+                                      tafl_engine.cached_moves(state)
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): from and to squares [N] and
+                                              the mask of captured squares
+                                              [N, 121] bool
+    """
+    moves = np.array(moves, dtype=np.intp).reshape(-1, 2)
+    frm, to = moves[:, 0], moves[:, 1]
+    cells = board_cells(state)
+    adjacent = playout.ADJACENT[to]
+    beyond = playout.BEYOND[to]
+    beyond_v = cells[beyond]
+    if state.a_turn:
+        enemy = cells[adjacent] == DEFENDER
+        friend = beyond_v == ATTACKER
+    else:
+        enemy = cells[adjacent] == ATTACKER
+        friend = (beyond_v == DEFENDER) | (beyond_v == KING)
+    # The from square can not be the far square of a capture: the square
+    # between would be on the path of the move, so empty
+    hostile = friend | (playout.SPECIAL[beyond] & (beyond_v == EMPTY))
+    rows, cols = np.nonzero(enemy & hostile)
+    captured = np.zeros((len(moves), engine.NUM_SQUARES), dtype=bool)
+    captured[rows, adjacent[rows, cols]] = True
+    return frm, to, captured
+
+
+class Evaluator(object):
+    """Material, king square and piece-square score, updated in place."""
+
+    def __init__(self, state=None, tables=None, weight=1.0):
+        """Create an evaluator, empty or from a tafl_engine.State.
+
+        Args:
+            state (State): the position to load
+            tables (np.ndarray): [3, 121] piece-square tables (see
+                                 fit_tables), None for none
+            weight (float): weight of the piece-square score
+        """
+        if tables is None:
+            self.table_array = None
+            self.tables = None
+        else:
+            self.table_array = np.asarray(tables, dtype=np.float64)
+            self.tables = self.table_array.tolist()
+        self.weight = weight
+        self.kinds = [None] * engine.NUM_SQUARES
+        self.a_turn = True
+        self.attackers = 0
+        self.defenders = 0
+        self.king = 0
+        self.pst = 0.0
+        self.history = []
+        if state is not None:
+            self.load(state)
+
+    def load(self, state):
+        """Reset the counts and scores to a tafl_engine.State."""
+        self.kinds = [None] * engine.NUM_SQUARES
+        for kind, bb in ((ATTACKER, state.attackers),
+                         (DEFENDER, state.defenders), (KING, state.king)):
+            for sq in engine.iter_bits(bb):
+                self.kinds[sq] = kind
+        self.a_turn = state.a_turn
+        self.attackers = engine.popcount(state.attackers)
+        self.defenders = engine.popcount(state.defenders)
+        self.king = state.king_sq
+        self.pst = 0.0
+        if self.tables is not None:
+            for sq, kind in enumerate(self.kinds):
+                if kind is not None:
+                    self.pst += self.tables[kind][sq]
+        self.history = []
+
+    def push(self, move, captured=0):
+        """Play a move and its captures.
+
+        Args:
+            move ((int, int)): (from, to) bit indices
+            captured (int): bitboard of the captured pieces, as recorded by
+                            tafl_engine.apply
+        """
+        frm, to = move
+        kinds = self.kinds
+        kind = kinds[frm]
+        kinds[frm] = None
+        kinds[to] = kind
+        if kind == KING:
+            self.king = to
+        victim = None
+        count = 0
+        for sq in engine.iter_bits(captured):
+            victim = kinds[sq]
+            kinds[sq] = None
+            count += 1
+        if victim == ATTACKER:
+            self.attackers -= count
+        elif victim == DEFENDER:
+            self.defenders -= count
+        pst = self.pst
+        tables = self.tables
+        if tables is not None:
+            pst += tables[kind][to] - tables[kind][frm]
+            if count:
+                row = tables[victim]
+                for sq in engine.iter_bits(captured):
+                    pst -= row[sq]
+        self.history.append((move, captured, victim, count, self.pst))
+        self.pst = pst
+        self.a_turn = not self.a_turn
+
+    def pop(self):
+        """Take back the last push.
+
+        Returns:
+            move ((int, int)): the move taken back
+        """
+        move, captured, victim, count, self.pst = self.history.pop()
+        self.a_turn = not self.a_turn
+        frm, to = move
+        kinds = self.kinds
+        kind = kinds[to]
+        kinds[to] = None
+        kinds[frm] = kind
+        if kind == KING:
+            self.king = frm
+        for sq in engine.iter_bits(captured):
+            kinds[sq] = victim
+        if victim == ATTACKER:
+            self.attackers += count
+        elif victim == DEFENDER:
+            self.defenders += count
+        return move
+
+    def push_last(self, state):
+        """Mirror the last tafl_engine.apply done on state."""
+        move, captured = state.history[-1][:2]
+        self.push(move, captured)
+
+    def evaluate(self, defender):
+        """Score the position for one side, like Simple_heuristic.
+
+        Args:
+            defender (bool): True to score for the defenders
+
+        Returns:
+            (float): higher is better for that side
+        """
+        value = ((NUM_ATTACKERS - self.attackers)
+                 - (NUM_DEFENDERS - self.defenders)
+                 + DISTANCE_WEIGHT * CORNER_DISTANCE[self.king])
+        # The tables score for the attackers
+        value -= self.weight * self.pst
+        if defender:
+            return value
+        return -value
+
+    def children_scores(self, frm, to, captured, defender):
+        """Score every child of the position at once, like evaluate.
+
+        Args:
+            frm, to, captured: the moves of the side to move, as returned by
+                               move_arrays
+            defender (bool): True to score for the defenders
+
+        Returns:
+            (np.ndarray): [N] float64 score of the position after each move
+        """
+        lost = captured.sum(axis=1)
+        attackers, defenders = self.attackers, self.defenders
+        if self.a_turn:
+            defenders = defenders - lost
+        else:
+            attackers = attackers - lost
+        king_move = frm == self.king
+        king = np.where(king_move, to, self.king)
+        value = ((NUM_ATTACKERS - attackers) - (NUM_DEFENDERS - defenders)
+                 + DISTANCE_WEIGHT * _CORNER_DISTANCE[king])
+        tables = self.table_array
+        if tables is not None:
+            if self.a_turn:
+                kind = np.full(len(frm), ATTACKER)
+                victim = tables[DEFENDER]
+            else:
+                kind = np.where(king_move, KING, DEFENDER)
+                victim = tables[ATTACKER]
+            pst = (self.pst + tables[kind, to] - tables[kind, frm]
+                   - captured @ victim)
+            value = value - self.weight * pst
+        if defender:
+            return value
+        return -value
+
+
+def features(state, out=None):
+    """One-hot piece placement of a position, [363] float32.
+
+    Feature kind * 121 + square is 1 when a piece of that kind stands there.
+    """
+    if out is None:
+        out = np.zeros(NUM_FEATURES, dtype=np.float32)
+    else:
+        out[:] = 0.0
+    for kind, bb in ((ATTACKER, state.attackers),
+                     (DEFENDER, state.defenders), (KING, state.king)):
+        offset = kind * engine.NUM_SQUARES
+        for sq in engine.iter_bits(bb):
+            out[offset + sq] = 1.0
+    return out
+
+
+def fit_tables(records, ridge=RIDGE, skip_plies=0):
+    """Fit piece-square tables to the results of recorded games.
+
+    Every position after skip_plies plies is a sample whose target is the
+    game result for the attackers (1, 0 or -1). The normal equations are
+    accumulated over batches of positions, so any number of games fits in
+    memory.
+
+    Args:
+        records (iterable(GameRecord)): games, e.g. game_record.read_games
+        ridge (float): L2 penalty on the table values
+        skip_plies (int): plies at the start of each game that are left out
+
+    Returns:
+        tables (np.ndarray): [3, 121] float32 piece-square tables
+    """
+    gram = np.zeros((NUM_FEATURES, NUM_FEATURES))
+    moment = np.zeros(NUM_FEATURES)
+    batch = np.zeros((FIT_BATCH, NUM_FEATURES), dtype=np.float32)
+    targets = np.zeros(FIT_BATCH, dtype=np.float32)
+    n = 0
+    for record in records:
+        for ply, state in enumerate(game_record.replay(record)):
+            if ply < skip_plies:
+                continue
+            features(state, batch[n])
+            targets[n] = record.result
+            n += 1
+            if n == FIT_BATCH:
+                gram += batch.T.astype(np.float64) @ batch
+                moment += batch.T.astype(np.float64) @ targets
+                n = 0
+    if n:
+        gram += batch[:n].T.astype(np.float64) @ batch[:n]
+        moment += batch[:n].T.astype(np.float64) @ targets[:n]
+    weights = np.linalg.solve(gram + ridge * np.eye(NUM_FEATURES), moment)
+    return weights.reshape(NUM_KINDS, engine.NUM_SQUARES).astype(np.float32)
+
+
+def save_tables(path, tables):
+    np.save(path, tables)
+
+
+def open_tables(path=TABLES_PATH):
+    """Load the tables at path, or return None if there are none."""
+    if not os.path.exists(path):
+        return None
+    tables = np.load(path)
+    if tables.shape != (NUM_KINDS, engine.NUM_SQUARES):
+        raise ValueError("{} does not hold piece-square tables".format(path))
+    return tables
+
+
+def main():
+    """Fit tables: python evaluation.py GAMES [TABLES] [SKIP_PLIES]."""
+    if len(sys.argv) < 2:
+        print("usage: python evaluation.py GAMES [TABLES] [SKIP_PLIES]")
+        sys.exit(1)
+    path = sys.argv[2] if len(sys.argv) > 2 else TABLES_PATH
+    skip = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    start = time.perf_counter()
+    tables = fit_tables(game_record.read_games(sys.argv[1]), skip_plies=skip)
+    save_tables(path, tables)
+    print("tables written to {} in {:.1f}s".format(
+        path, time.perf_counter() - start))
+    for kind, name in ((ATTACKER, "attackers"), (DEFENDER, "defenders"),
+                       (KING, "king")):
+        print(name)
+        print(np.array2string(tables[kind].reshape(engine.DIM, engine.DIM),
+                              precision=2, suppress_small=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Compact binary game records.
+
+A record file starts with the 4 byte magic b"TAFL" and a version byte and is
+followed by games, one after the other. Each game is a 4 byte header (variant
+id, result, number of plies) and then two bytes per ply, the tafl_engine
+from and to squares. A 1000 ply game takes about 2 KB, so millions of
+self-play games fit on disk and are read back one at a time without holding
+the file in memory. Results are from the attackers' point of view: 1 if the
+king was killed, -1 if it escaped and 0 for a draw.
+"""
+
+import collections
+import os
+import struct
+import sys
+import time
+import tafl_engine as engine
+
+MAGIC = b"TAFL"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sB")
+GAME_HEADER = struct.Struct("<BbH")
+MAX_PLIES = 0xFFFF
+
+# Variant id -> starting layout, see tafl_engine.START_GRID
+HNEFATAFL = 0
+VARIANTS = {HNEFATAFL: engine.START_GRID}
+
+GameRecord = collections.namedtuple("GameRecord", "variant result moves")
+
+
+class GameWriter(object):
+    """Append games to a record file.
+
+    Whole games are written with write. A game loop can instead call record
+    after every ply and finish with the result once the game is over; only
+    the moves of the game in progress are kept in memory.
+    """
+
+    def __init__(self, path, variant=HNEFATAFL):
+        """Open path for appending, writing the file header if it is new.
+
+        Args:
+            path (str): the record file
+            variant (int): variant id of the games, a key of VARIANTS
+        """
+        if variant not in VARIANTS:
+            raise ValueError("Unknown variant {}".format(variant))
+        self.variant = variant
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            _check_header(path)
+        self.file = open(path, "ab")
+        if new:
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self.games = 0
+        self.moves = bytearray()
+
+    @property
+    def plies(self):
+        """Number of plies recorded in the game in progress."""
+        return len(self.moves) // 2
+
+    def record(self, move):
+        """Add one (from, to) move to the game in progress."""
+        self.moves += bytes(move)
+
+    def finish(self, result):
+        """Write the game in progress with its result and start a new one."""
+        self._write(self.moves, result)
+        self.moves = bytearray()
+
+    def discard(self):
+        """Drop the game in progress without writing it."""
+        self.moves = bytearray()
+
+    def write(self, moves, result):
+        """Write a whole game.
+
+        Args:
+            moves (list((int, int))): the (from, to) moves played
+            result (int): 1, -1 or 0, see the module docstring
+        """
+        data = bytearray(2 * len(moves))
+        data[0::2] = bytes(m[0] for m in moves)
+        data[1::2] = bytes(m[1] for m in moves)
+        self._write(data, result)
+
+    def _write(self, data, result):
+        plies = len(data) // 2
+        if plies > MAX_PLIES:
+            raise ValueError("Games are limited to {} plies".format(MAX_PLIES))
+        self.file.write(GAME_HEADER.pack(self.variant, result, plies))
+        self.file.write(data)
+        self.games += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _check_header(path):
+    with open(path, "rb") as f:
+        header = f.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size:
+        raise ValueError("{} is not a game record file".format(path))
+    magic, version = FILE_HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("{} is not a game record file".format(path))
+    if version != VERSION:
+        raise ValueError("{} has record version {}, expected {}".format(
+            path, version, VERSION))
+
+
+def read_games(path):
+    """Iterate over the games of a record file, reading one at a time.
+
+    Yields:
+        (GameRecord): variant, result and the list of (from, to) moves
+    """
+    _check_header(path)
+    with open(path, "rb", buffering=1 << 20) as f:
+        f.seek(FILE_HEADER.size)
+        while True:
+            header = f.read(GAME_HEADER.size)
+            if not header:
+                return
+            if len(header) < GAME_HEADER.size:
+                raise ValueError("{} ends inside a game header".format(path))
+            variant, result, plies = GAME_HEADER.unpack(header)
+            data = f.read(2 * plies)
+            if len(data) < 2 * plies:
+                raise ValueError("{} ends inside a game".format(path))
+            yield GameRecord(variant, result, list(zip(data[0::2],
+                                                       data[1::2])))
+
+
+def initial_state(record):
+    """Starting position of a game record's variant."""
+    return engine.state_from_grid(VARIANTS[record.variant])
+
+
+def replay(record):
+    """Play a game record through, yielding each position.
+
+    The starting position is yielded first and the final position last. The
+    same tafl_engine.State is updated in place between positions; copy it to
+    keep one.
+
+    Yields:
+        (State): the position before each ply, then the final position
+    """
+    state = initial_state(record)
+    yield state
+    for m in record.moves:
+        engine.apply(state, m)
+        yield state
+
+
+def iter_positions(path):
+    """Every position of every game in a record file, read lazily.
+
+    Yields:
+        (State, GameRecord): the position (updated in place, see replay) and
+                             the game it belongs to
+    """
+    for record in read_games(path):
+        for state in replay(record):
+            yield state, record
+
+
+def main():
+    """Summarise a record file and time how fast it is read and replayed."""
+    if len(sys.argv) < 2:
+        print("usage: python game_record.py FILE")
+        sys.exit(1)
+    path = sys.argv[1]
+    results = {1: 0, -1: 0, 0: 0}
+    games = plies = 0
+    start = time.perf_counter()
+    for record in read_games(path):
+        games += 1
+        plies += len(record.moves)
+        results[record.result] += 1
+    read = time.perf_counter() - start
+    start = time.perf_counter()
+    positions = sum(1 for _ in iter_positions(path))
+    replayed = time.perf_counter() - start
+    print("{} games, {} plies, {} bytes".format(games, plies,
+                                                os.path.getsize(path)))
+    print("attackers {} / defenders {} / draws {}".format(
+        results[1], results[-1], results[0]))
+    print("read {:.0f} games/s, replayed {:.0f} positions/s".format(
+        games / max(read, 1e-9), positions / max(replayed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
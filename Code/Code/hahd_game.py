@@ -31,7 +31,7 @@ def run_hahd_game(screen):
     also listens for KEYDOWN event. If the game has ended or the player wants
     to restart the game, it will listen for 'y' or 'n'. If the player wants
     to restart the game, they can press 'r', which will require confirmation
-    before actually restarting.
+    before actually restarting. Pressing 'u' takes back the last move.
 
     Args:
         screen (pygame.Surface): The game window
@@ -57,6 +57,8 @@ def run_hahd_game(screen):
                     return True
                 if event.key == pygame.K_r:
                     move.restart = True
+                if event.key == pygame.K_u and move.history and not move.selected:
+                    move.unmake()
             if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                 pos = pygame.mouse.get_pos()
                 if move.game_over:
@@ -79,14 +81,7 @@ def run_hahd_game(screen):
                         move.select(tafl.Current.sprites()[0])
                         tafl.Current.empty()
                     elif move.is_valid_move(pos, tafl.Current.sprites()[0]):
-                        if tafl.Current.sprites()[0] in tafl.Kings:
-                            move.king_escaped(tafl.Kings)
-                        if move.a_turn:
-                            move.remove_pieces(tafl.Defenders, tafl.Attackers, tafl.Kings)
-
-                        else:
-                            move.remove_pieces(tafl.Attackers, tafl.Defenders, tafl.Kings)
-                        move.end_turn(tafl.Current.sprites()[0])
+                        move.complete_move(tafl.Current.sprites()[0])
                         tafl.Current.empty()
 
         """Text to display on bottom of game."""
@@ -8,6 +8,7 @@ Date: 7/13/2015
 """
 
 import pygame
+import tafl_engine as engine
 
 WINDOW_SIZE = WIDTH, HEIGHT = 640, 700
 MARGIN_COLOR = 128, 102, 69
@@ -34,6 +35,11 @@ class Move(object):
         escaped: Bool which is true if the king escaped
         game_over: Bool which is true if either player has won or its a draw
         restart: Bool which pauses game and asks if players want to restart
+        start: Tile the selected piece started its move from
+        history: Undo stack of completed moves, see complete_move
+        squares: tafl_engine square -> piece lookup, see board_squares
+        occupied: bitboard of the squares in squares
+        position: tafl_engine.State mirroring the board, see board_squares
         """
         self.a_turn = True
         self.selected = False
@@ -41,6 +47,48 @@ class Move(object):
         self.escaped = False
         self.game_over = False
         self.restart = False
+        self.start = None
+        self.history = []
+        self.squares = None
+        self.occupied = 0
+        self.position = None
+
+    def board_squares(self):
+        """Return the square -> piece lookup, building it on first use.
+
+        The lookup and the engine position are built once from the sprite
+        groups and are then kept up to date by complete_move and unmake, so
+        finding the piece on a tile does not need a pass over every sprite
+        and the position (and its Zobrist key) is always at hand.
+
+        Returns:
+            squares (dict(int, Piece)): pieces keyed by tafl_engine square
+        """
+        if self.squares is None:
+            self.squares = {}
+            self.occupied = 0
+            attackers = defenders = king = 0
+            for p in Pieces:
+                sq = engine.square(p.x_tile, p.y_tile)
+                self.squares[sq] = p
+                self.occupied |= engine.BIT[sq]
+                if p in Kings:
+                    king |= engine.BIT[sq]
+                elif p in Attackers:
+                    attackers |= engine.BIT[sq]
+                else:
+                    defenders |= engine.BIT[sq]
+            self.position = engine.State(attackers, defenders, king,
+                                         self.a_turn)
+        return self.squares
+
+    def _lift(self, sq):
+        self.occupied &= ~engine.BIT[sq]
+        return self.squares.pop(sq)
+
+    def _place(self, sq, piece):
+        self.occupied |= engine.BIT[sq]
+        self.squares[sq] = piece
 
     def select(self, piece):
         """Allow players to select one of their pieces to move.
@@ -60,6 +108,8 @@ class Move(object):
             piece.color = (247, 5, 215)
             self.row = piece.x_tile
             self.col = piece.y_tile
+            self.start = (self.row, self.col)
+            self.board_squares()
             self.vm = self.valid_moves(piece.special_sqs)
         else:
             self.selected = False
@@ -68,9 +118,29 @@ class Move(object):
     def valid_moves(self, special_sqs):
         """Determine the valid moves for the selected piece.
 
-        Currently there are four very similar functions to determine all valid
-        moves to the left, the right, above, and below. These functions need to
-        be refactored.
+        The destinations come from tafl_engine.MOVE_CACHE for the position
+        kept by board_squares, so no pixel collisions are needed and the
+        moves of a ply are generated once for every piece that is selected
+        and for the computer players.
+
+        Args:
+            special_sqs (bool): True if piece can move on special squares;
+                                the position already tells which piece is
+                                the king, so it is not needed here
+
+        Returns:
+            vm (set(int,int)): Set of valid moves.
+        """
+        self.board_squares()
+        dest = engine.MOVE_CACHE.destinations(
+            self.position, engine.square(self.row, self.col))
+        return set(engine.coords(sq) for sq in engine.iter_bits(dest))
+
+    def sprite_valid_moves(self, special_sqs):
+        """Determine the valid moves for the selected piece from sprites.
+
+        This is the original collision based move generation. It is kept as
+        a reference to check tafl_engine against (see tools.count_sprite_moves).
 
         Args:
             special_sqs (bool): True if piece can move on special squares
@@ -126,33 +196,105 @@ class Move(object):
     def remove_pieces(self, g1, g2, Kings):
         """Determine if any pieces need to be removed from the board.
 
-        check_pts is a list of four tuples. Each tuple is a tuple of tile
-        coordinates, the first of which is directly next to the square
-        where the piece moved, and the second of which is two squares away
-        in the same direction. First, the function checks to see if there is
-        an opponent's piece adjacent to where the player just moved his
-        piece. If there is one, then it checks if the other side of the
-        opponenet's piece is either occupied by the player's piece or if it
-        is an unoccupied hostile territory (SPECIALSQS). If either of those
-        is true, then the piece is captured, and removed from the board.
+        tafl_engine.CAPTURE_SQUARES lists, for the square where the piece
+        moved, pairs of squares: the first directly next to it, the second
+        two squares away in the same direction. If the first holds an
+        opponent's piece and the second is either occupied by the player's
+        piece or is an unoccupied hostile territory (SPECIALSQS), the piece
+        is captured and removed from the board. Pieces are found with the
+        board_squares lookup, so no pass over the groups is needed.
+
+        Args:
+            g1 (Group(sprites)): the opponent's pieces
+            g2 (Group(sprites)): the current player's pieces
+            Kings (Group(sprites)): the group containing the king
+
+        Returns:
+            captured (list((Piece, list(Group)))): the removed pieces with the
+                                                   groups they belonged to,
+                                                   so they can be restored.
+        """
+        squares = self.board_squares()
+        to = engine.square(self.row, self.col)
+        king = Kings.sprites()[0]
+        king_sq = engine.square(king.x_tile, king.y_tile)
+        captured = []
+        if king in g1 and king_sq in engine.NEIGHBOUR_SQUARES[to]:
+            if self.kill_king(king.x_tile, king.y_tile, g2):
+                self.king_killed = True
+                self.game_over = True
+                captured.append(king)
+        for adjacent, far in engine.CAPTURE_SQUARES[to]:
+            p1 = squares.get(adjacent)
+            if p1 is None or p1 is king or p1 not in g1:
+                continue
+            p2 = squares.get(far)
+            if p2 is not None and p2 in g2:
+                captured.append(p1)
+            elif far in engine.SPECIAL_SQUARES and far != king_sq:
+                captured.append(p1)
+        removed = []
+        for a in captured:
+            # Piece.groups is shadowed by the class attribute set in
+            # tools.initialize_groups, so call the Sprite method directly.
+            removed.append((a, pygame.sprite.Sprite.groups(a)))
+            a.kill()
+        return removed
+
+    def kill_king(self, x, y, attackers):
+        """Determine if the king has been killed.
+
+        The king is killed if it is surrounded on all four sides by attacking
+        pieces or hostile territories. A king on the edge has fewer than four
+        neighbours and cannot be killed.
+
+        Args:
+            x (int): x tile coordinate of the king
+            y (int): y tile coordinate of the king
+
+        Returns:
+            True if king has been killed, False o.w.
+        """
+        around = engine.NEIGHBOUR_SQUARES[engine.square(x, y)]
+        if len(around) < 4:
+            return False
+        squares = self.board_squares()
+        for sq in around:
+            if sq in engine.SPECIAL_SQUARES:
+                continue
+            p = squares.get(sq)
+            if p is None or p not in attackers:
+                return False
+        return True
+
+    def sprite_captures(self, g1, g2, Kings):
+        """Find the captures of the last move by searching the groups.
+
+        This is the original group scan of remove_pieces and kill_king. It
+        removes nothing and is kept as a reference to check the lookup
+        tables against (see check_rules.py).
 
         Args:
             g1 (Group(sprites)): the opponent's pieces
             g2 (Group(sprites)): the current player's pieces
             Kings (Group(sprites)): the group containing the king
+
+        Returns:
+            (list(Piece), bool): the pieces that would be captured and True
+                                 if the king would be killed
         """
         check_pts = set([((self.row, self.col + 1), (self.row, self.col + 2)),
                          ((self.row + 1, self.col), (self.row + 2, self.col)),
                          ((self.row, self.col - 1), (self.row, self.col - 2)),
                          ((self.row - 1, self.col), (self.row - 2, self.col))])
         captured = []
+        king_killed = False
         king = (Kings.sprites()[0].x_tile, Kings.sprites()[0].y_tile)
         for square in check_pts:
             if square[0] == king:
                 if Kings.sprites()[0] in g1:
-                    if self.kill_king(king[0], king[1], g2):
-                        self.king_killed = True
-                        self.game_over = True
+                    if self.sprite_kill_king(king[0], king[1], g2):
+                        king_killed = True
                         captured.append(Kings.sprites()[0])
             else:
                 for p1 in g1:
@@ -163,22 +305,10 @@ class Move(object):
                             elif square[1] in SPECIALSQS:
                                 if square[1] != king:
                                     captured.append(p1)
-        for a in captured:
-            a.kill()
-
-    def kill_king(self, x, y, attackers):
-        """Determine if the king has been killed.
-
-        The king is killed if it is surrounded on all four sides by attacking
-        pieces or hostile territories.
-
-        Args:
-            x (int): x tile coordinate of the king
-            y (int): y tile coordinate of the king
+        return list(dict.fromkeys(captured)), king_killed
 
-        Returns:
-            True if king has been killed, False o.w.
-        """
+    def sprite_kill_king(self, x, y, attackers):
+        """Original group scan version of kill_king, see sprite_captures."""
         kill_pts = set([(x, y + 1), (x + 1, y), (x, y - 1), (x - 1, y)])
         kill_pts.difference_update(SPECIALSQS)
         attack_pts = set()
@@ -310,6 +440,58 @@ class Move(object):
         """
         return (self.ppos(x) + (GSIZE // 2), self.ppos(y) + (GSIZE // 2))
 
+    def complete_move(self, piece):
+        """Finish a move once is_valid_move has placed the piece.
+
+        Checks for an escape, removes captured pieces and ends the turn. The
+        start and end tiles, the captured pieces and the game status before
+        the move are pushed on the history stack so unmake can take the move
+        back.
+
+        Args:
+            piece (Piece): the piece that was moved
+        """
+        record = (piece, self.start, self.a_turn, self.king_killed,
+                  self.escaped, self.game_over)
+        self.board_squares()
+        self._place(engine.square(self.row, self.col),
+                    self._lift(engine.square(*self.start)))
+        if piece in Kings:
+            self.king_escaped(Kings)
+        if self.a_turn:
+            captured = self.remove_pieces(Defenders, Attackers, Kings)
+        else:
+            captured = self.remove_pieces(Attackers, Defenders, Kings)
+        for p, groups in captured:
+            self._lift(engine.square(p.x_tile, p.y_tile))
+        engine.apply(self.position, (engine.square(*self.start),
+                                     engine.square(self.row, self.col)))
+        self.history.append(record + ((self.row, self.col), captured))
+        self.end_turn(piece)
+
+    def unmake(self):
+        """Take back the last move finished with complete_move.
+
+        Captured pieces are put back in their groups, the moved piece
+        returns to its start tile and the turn and game status are restored.
+
+        Returns:
+            piece (Piece): the piece that was moved back
+        """
+        (piece, start, self.a_turn, self.king_killed, self.escaped,
+         self.game_over, end, captured) = self.history.pop()
+        for p, groups in captured:
+            p.add(*groups)
+            self._place(engine.square(p.x_tile, p.y_tile), p)
+        self._place(engine.square(*start), self._lift(engine.square(*end)))
+        engine.undo(self.position, (engine.square(*start),
+                                    engine.square(*end)))
+        piece.pos_cent(start[0], start[1])
+        self.row, self.col = start
+        self.selected = False
+        piece.color = piece.base_color
+        return piece
+
     def end_turn(self, piece):
         """Perform some cleanup to end the turn.
 
@@ -333,7 +515,8 @@ class Board(object):
         """Create a playing board and color code it.
 
         Attributes:
-            grid (list(str)): A list of strings which classify each tile. Each
+            grid (list(str)): A list of strings which classify each tile,
+                              copied from tafl_engine.START_GRID. Each
                               char in the string maps to a type of tile:
                                   x -> corner tile
                                   a -> initial attack tile
@@ -343,17 +526,7 @@ class Board(object):
             dim (int): Dimension of the board (i.e. num of rows or cols.)
             piece (int): Size of playing piece.
         """
-        self.grid = ["x..aaaaa..x",
-                     ".....a.....",
-                     "...........",
-                     "a....d....a",
-                     "a...ddd...a",
-                     "aa.ddcdd.aa",
-                     "a...ddd...a",
-                     "a....d....a",
-                     "...........",
-                     ".....a.....",
-                     "x..aaaaa..x"]
+        self.grid = list(engine.START_GRID)
 
         self.colors = {'x': (92, 83, 70),
                        'a': (48, 43, 14),
@@ -11,14 +11,32 @@ Date: 4/4/2019
 import sys
 import pygame
 from pygame.locals import *
-import random
 import numpy as np
 import hnefatafl as tafl
 import tools as tool
+import tafl_engine as engine
+import agents
+import pacing
+import board_array
+import selfplay
+import td_learning as td
+import escape
+import game_record
+import tablebase
+import evaluation
 import value_net as vn
-import torch
-import time
-import copy
+
+
+MODEL_PATH = "attacker_model.pt"
+# Self-play games are appended here, see game_record
+GAMES_PATH = "selfplay.tafl"
+# Endgame tables consulted by the agents, None until tablebase.py has run
+TABLEBASE = tablebase.open_tablebase()
+# Piece-square tables for Hingston_Simple_Agent, None until evaluation.py
+# has fitted them
+PIECE_SQUARE = evaluation.open_tables()
+# Weight of the capture and king-escape terms added to the TD rewards
+SHAPING = 0.05
 
 
 def Simple_heuristic(game_state, defender):
@@ -35,79 +53,45 @@ def Simple_heuristic(game_state, defender):
 
 
 def Hingston_Simple_Agent(move, defender):
-    game_state = game_state_to_array()  # Preserves the current game state
-
-    if move.a_turn:
-        pieces = tafl.Attackers
-    else:
-        pieces = tafl.Defenders
+    state = tool.engine_state(move)  # Headless copy of the current game state
+    # Simple_heuristic kept up to date move by move, see evaluation
+    evaluator = evaluation.Evaluator(state, PIECE_SQUARE)
 
     best_score = -99999999999999.0
-    best_piece = None
     best_move = None
-    best_game_state = None
-    # len("N Pieces: ",len(pieces))
-    for piece in pieces:
-        move.select(piece)  # Move class defines all possible valid moves
-        tafl.Current.add(piece)
-        if len(move.vm) == 0:  # No valid moves for this piece, move on
-            move.select(piece)
-            tafl.Current.empty()
-            continue
-        else:
-            for m in move.vm:
-                # Swap game state for candidate move
-                temp = game_state[piece.x_tile][piece.y_tile]
-                game_state[piece.x_tile][piece.y_tile] = 0
-                game_state[m[0]][m[1]] = temp
-                score = Simple_heuristic(game_state, defender)
-                # print(game_state)
-                # print(Simple_heuristic(game_state))
-                # model.predict(game_state.reshape(1, 11 * 11))[0][0]
-
-                if score > best_score:
-                    best_score = score
-                    best_piece = piece
-                    best_move = m
-
-                # Reverse swap to restore game state
-                temp = game_state[m[0]][m[1]]
-                game_state[piece.x_tile][piece.y_tile] = temp
-                game_state[m[0]][m[1]] = 0
-        move.select(piece)  # Deselect
-        tafl.Current.empty()
-
-    move.select(best_piece)
-    tafl.Current.add(best_piece)
-    # print("Moving piece to: {}".format(pos))
-    if move.is_valid_move(best_move, tafl.Current.sprites()[0], True):
-        if tafl.Current.sprites()[0] in tafl.Kings:
-            move.king_escaped(tafl.Kings)
-        if move.a_turn:
-            move.remove_pieces(tafl.Defenders, tafl.Attackers, tafl.Kings)
-        else:
-            move.remove_pieces(tafl.Attackers, tafl.Defenders, tafl.Kings)
-        move.end_turn(tafl.Current.sprites()[0])
-        tafl.Current.empty()
-        # return best_score,game_state_to_array()
-        # Just do this by hand for efficiency
-        temp = game_state[best_piece.x_tile][best_piece.y_tile]
-        game_state[best_piece.x_tile][best_piece.y_tile] = 0
-        game_state[best_move[0]][best_move[1]] = temp
-
-        # print(game_state,best_score)
-        return game_state, best_score
-    else:
-        print("ERROR: Efficient move logic failed... Fix!")
-        sys.exit(1)
-
-
-def run_game_random(screen=None):
+    if TABLEBASE is not None:
+        best_move = TABLEBASE.best_move(state)
+    if best_move is not None:
+        engine.apply(state, best_move)
+        evaluator.push_last(state)
+        best_score = evaluator.evaluate(defender)
+        tool.play_engine_move(move, best_move)
+        return game_state_to_array(), best_score
+
+    # Every child, captures included, is scored in one NumPy pass; argmax
+    # keeps the first of equal scores like the old loop did
+    moves = engine.cached_moves(state)
+    scores = evaluator.children_scores(*evaluation.move_arrays(state, moves),
+                                       defender=defender)
+    best = int(np.argmax(scores))
+    best_move, best_score = moves[best], float(scores[best])
+
+    tool.play_engine_move(move, best_move)
+    return game_state_to_array(), best_score
+
+
+def run_game_random(screen=None, pacer=None, writer=None):
     """Start a new game with random (legal) moves.
 
-    TODO: Add description
+    Plays random moves for both sides until a win or a 1000 ply draw.
 
+    Args:
+        screen (pygame.Surface): The game window, None to run headless
+        pacer (Pacer): waits once per ply, defaults to no waiting
+        writer (GameWriter): records the game, None to not keep it
     """
+    if pacer is None:
+        pacer = pacing.Pacer()
     board = tafl.Board()
     move = tafl.Move()
     tool.initialize_pieces(board)
@@ -128,10 +112,16 @@ def run_game_random(screen=None):
             print(text)
         '''
         # print(move.to_array())
-        do_random_move(move)
+        if not tool.do_random_move(move):
+            print("Draw game, no legal move after {} moves".format(num_moves))
+            finish_record(writer, 0)
+            return False
+        if writer is not None:
+            tool.record_moves(writer, move)
         num_moves += 1
         if num_moves >= 1000:
             print("Draw game after {} moves".format(num_moves))
+            finish_record(writer, 0)
             return False
 
         """Text to display on bottom of game."""
@@ -140,70 +130,53 @@ def run_game_random(screen=None):
             text = "King escaped! Defenders win!"
             print(text)
             text2 = "Play again? y/n"
+            finish_record(writer, -1)
             return False
         if move.king_killed:
             text = "King killed! Attackers win!"
             print(text)
             text2 = "Play again? y/n"
+            finish_record(writer, 1)
             return False
         if move.restart:
             text = "Restart game? y/n"
             print(text)
+            if writer is not None:
+                writer.discard()
             return False
         if screen is not None:
             tool.update_image(screen, board, "tafl")
-            pygame.display.update()
-        # time.sleep(1)
+        pacer.wait()
 
 
-def do_random_move(move):
-    if move.a_turn:
-        pieces = tafl.Attackers
-    else:
-        pieces = tafl.Defenders
-    while 1:
-        # rn = int(random.random() * len(pieces.sprites()))
-        # piece = pieces.sprites()[rn]
-        piece = random.choice(pieces.sprites())
-        move.select(piece)
-        tafl.Current.add(piece)
-        # print("Piece at: {} {}".format(piece.x_tile,piece.y_tile))
-        # print("  Valid Moves: {}".format(move.vm))
-        if len(move.vm) == 0:
-            # print("No valid moves...")
-            move.select(piece)
-            tafl.Current.empty()
-            continue
-        else:
-            pos = random.choice(tuple(move.vm))
-            # print("Moving piece to: {}".format(pos))
-            if move.is_valid_move(pos, tafl.Current.sprites()[0], True):
-                if tafl.Current.sprites()[0] in tafl.Kings:
-                    move.king_escaped(tafl.Kings)
-                if move.a_turn:
-                    move.remove_pieces(tafl.Defenders, tafl.Attackers, tafl.Kings)
-                else:
-                    move.remove_pieces(tafl.Attackers, tafl.Defenders, tafl.Kings)
-                move.end_turn(tafl.Current.sprites()[0])
-                tafl.Current.empty()
-            break
-
-
-def run_game_cacd_RL(screen, attacker_model):
+def run_game_cacd_RL(screen, attacker_model, pacer=None, trainer=None,
+                     writer=None):
     """Start and run one game of computer vs computer hnefatafl.
 
-    TODO: Add description
+    Model driven attackers play random defenders, training on every ply.
 
+    Args:
+        screen (pygame.Surface): The game window, None to run headless
+        attacker_model (HingstonNetwork): value network of the attackers
+        pacer (Pacer): waits once per ply, defaults to no waiting so that
+                       training runs as fast as the CPU allows
+        trainer (TDTrainer): learns from the game as it is played, None to
+                             only play
+        writer (GameWriter): records the game, None to not keep it
     """
+    if pacer is None:
+        pacer = pacing.Pacer()
     board = tafl.Board()
-    fake_board = copy.deepcopy(board)
     move = tafl.Move()
     tool.initialize_pieces(board)
+    # Updated in place after every ply instead of rebuilding a grid
+    arrays = board_array.ArrayBoard(tool.engine_state(move))
+    if trainer is not None:
+        trainer.observe(arrays.cells)
     num_moves = 0
     while 1:
         if screen is not None:
             tool.update_image(screen, board, "")
-            pygame.display.update()
             for event in pygame.event.get():
                 if event.type == QUIT:
                     sys.exit()
@@ -212,96 +185,64 @@ def run_game_cacd_RL(screen, attacker_model):
 
         num_moves += 1
         if num_moves >= 1000:
-            return 0
+            return end_game(trainer, 0, writer)
 
+        game_state_previous = arrays.as_float().copy()
         if move.a_turn:
             # print("Attacker's Turn: Move {}".format(num_moves))
-            game_state_previous = game_state_to_array_board(fake_board)
-            do_best_move(move, attacker_model, fake_board)
-            tool.update_grid(fake_board)
-            game_state_current = game_state_to_array_board(fake_board)
-            update_value_function(game_state_previous, game_state_current, attacker_model)
-            time.sleep(10)
-
+            moved = do_best_move(move, attacker_model)
         else:
             # print("Defender's Turn: Move {}".format(num_moves))
-            game_state_previous = game_state_to_array_board(fake_board)
-            do_random_move(move)
-            tool.update_grid(fake_board)
-            game_state_current = game_state_to_array_board(fake_board)
-            time.sleep(10)
+            moved = tool.do_random_move(move)
+        if not moved:
+            # The side to move is stuck; a draw, as in selfplay.play_game
+            return end_game(trainer, 0, writer)
+        arrays.push(*tool.last_engine_move(move))
+        if writer is not None:
+            tool.record_moves(writer, move)
+        game_state_current = arrays.as_float()
+        if trainer is not None:
+            update_value_function(game_state_previous, game_state_current, trainer)
+        pacer.wait()
 
         """Text to display on bottom of game."""
         if move.escaped:
-            return -1
+            return end_game(trainer, -1, writer)
         if move.king_killed:
-            return 1
+            return end_game(trainer, 1, writer)
 
 
-def do_best_move(move, model, board):
-    """ Function to try all possible moves and select the best according to the model provided
-    """
+def end_game(trainer, result, writer=None):
+    """Let the trainer learn from the finished game, then return the result."""
+    finish_record(writer, result)
+    if trainer is not None:
+        loss = trainer.end_game(result)
+        if loss is not None:
+            print("TD loss {:.4f} after {} games".format(loss, trainer.games))
+    return result
 
-    game_state = game_state_to_array_board(board)  # Preserves the current game state
 
-    # print(game_state)
-    # print("==============================================================================")
-    if move.a_turn:
-        pieces = tafl.Attackers
-    else:
-        pieces = tafl.Defenders
+def finish_record(writer, result):
+    """Write the finished game to writer, if there is one."""
+    if writer is not None:
+        writer.finish(result)
 
-    best_score = -99999999999999999999.0
-    best_piece = None
-    best_move = None
-    # len("N Pieces: ",len(pieces))
-    for piece in pieces:
-        move.select(piece)  # Move class defines all possible valid moves
-        tafl.Current.add(piece)
-        if len(move.vm) == 0:  # No valid moves for this piece, move on
-            move.select(piece)
-            tafl.Current.empty()
-            continue
-        else:
-            for m in move.vm:
-                # Swap game state for candidate move
-                temp = game_state[piece.x_tile][piece.y_tile]
-                game_state[piece.x_tile][piece.y_tile] = 0
-                game_state[m[0]][m[1]] = temp
-                try:  # model.predict crashed once...
-                    tens = torch.from_numpy(game_state).reshape([1, 1, 11, 11])
-                    score = model(tens).detach().numpy()[0]
-                except:
-                    print("Erorr")
-                    score = -1.0
-
-                if score > best_score:
-                    best_score = score
-                    best_piece = piece
-                    best_move = m
-
-                # Reverse swap to restore game state
-                temp = game_state[m[0]][m[1]]
-                game_state[piece.x_tile][piece.y_tile] = temp
-                game_state[m[0]][m[1]] = 0
-        move.select(piece)  # Deselect
-        tafl.Current.empty()
-
-    move.select(best_piece)
-    tafl.Current.add(best_piece)
-    # best_piece_copy = copy.deepcopy(best_piece)
-    if move.is_valid_move(best_move, tafl.Current.sprites()[0], True):
-        if tafl.Current.sprites()[0] in tafl.Kings:
-            move.king_escaped(tafl.Kings)
-        if move.a_turn:
-            move.remove_pieces(tafl.Defenders, tafl.Attackers, tafl.Kings)
-        else:
-            move.remove_pieces(tafl.Attackers, tafl.Defenders, tafl.Kings)
-        move.end_turn(tafl.Current.sprites()[0])
-        tafl.Current.empty()
-    else:
-        print("ERROR: Efficient move logic failed... Fix!")
-        sys.exit(1)
+
+def do_best_move(move, model):
+    """ Function to try all possible moves and select the best according to the model provided
+
+    Every child position is written into one [N, 1, 11, 11] batch which the
+    model scores in a single forward pass (see agents.value_move). Endgames
+    in TABLEBASE are played from the tables.
+
+    Returns:
+        (bool): False if the side to move had no move, so none was played
+    """
+    best_move = agents.value_move(tool.engine_state(move), model, TABLEBASE)
+    if best_move is None:
+        return False
+    tool.play_engine_move(move, best_move)
+    return True
 
 
 def game_state_to_array():
@@ -322,98 +263,66 @@ def game_state_to_array():
     return arr
 
 
-def game_state_to_array_board(board):
-    """2D Numpy array representation of game state for ML model.
-    """
-
-    arr = np.zeros((11, 11), dtype=np.float32)
-
-    for x in range(board.dim):
-        for y in range(board.dim):
-            if board.grid[x][y] == "a":
-                arr[x][y] = 1.0
-            if board.grid[x][y] == "d":
-                arr[x][y] = -1.0
-            if board.grid[x][y] == "c":
-                arr[x][y] = -2.0
-
-    return arr.transpose()
+def update_value_function(game_state_previous, game_state_current, trainer):
+    """Record one ply for TD learning.
 
-def update_value_function(game_state_previous,game_state_current,attacker_model):
-    tens_previous = torch.from_numpy(game_state_previous).reshape([1, 1, 11, 11])
-    V_previous = attacker_model(tens_previous).detach().numpy()[0]
-    tens_current = torch.from_numpy(game_state_current).reshape([1, 1, 11, 11])
-    V_current = attacker_model(tens_current).detach().numpy()[0]
+    The capture and king-escape features of the ply become a small shaping
+    reward for the attackers; the trainer turns the rewards and the final
+    result into TD(lambda) targets and steps its optimizer when the game ends.
 
+    Args:
+        game_state_previous (np.ndarray): 11x11 board before the ply
+        game_state_current (np.ndarray): 11x11 board after the ply
+        trainer (TDTrainer): the learner of the attackers' value network
+    """
     white_pieces_number_previous = np.count_nonzero(game_state_previous == -1)
     white_pieces_number_current = np.count_nonzero(game_state_current == -1)
     captured_white_pieces_number = white_pieces_number_previous - white_pieces_number_current
 
-    avoid_the_king_from_escaping = (is_the_king_about_to_escape(game_state_previous) and
-                                    not is_the_king_about_to_escape(game_state_current))
-    create_a_way_for_king_to_escape = (not is_the_king_about_to_escape(game_state_previous) and
-                                       is_the_king_about_to_escape(game_state_current))
-    #if avoid_the_king_from_escaping:
-        #print("king avoided")
-    # print(V_previous)
-    # print(V_current)
-    # print("========================================================")
+    escape_previous = is_the_king_about_to_escape(game_state_previous)
+    escape_current = is_the_king_about_to_escape(game_state_current)
+    avoid_the_king_from_escaping = escape_previous and not escape_current
+    create_a_way_for_king_to_escape = not escape_previous and escape_current
+    reward = SHAPING * (captured_white_pieces_number
+                        + int(avoid_the_king_from_escaping)
+                        - int(create_a_way_for_king_to_escape))
+    trainer.observe(game_state_current, reward)
 
 
 def is_the_king_about_to_escape(game_state):
-    king_coordinates = np.argwhere(game_state == -2)
-    king_x = king_coordinates[0][0]
-    king_y = king_coordinates[0][1]
-    king_is_about_to_escape = False
-
-    if king_x == 0 or king_x == 10:
-        king_is_about_to_escape = True
-        for j in range(0, king_y):
-            if game_state[king_x][j] != 0:
-                king_is_about_to_escape = False
-        if king_is_about_to_escape:
-            return True
-        king_is_about_to_escape = True
-        for j in range(king_y + 1, 10):
-            if game_state[king_x][j] != 0:
-                king_is_about_to_escape = False
-        if king_is_about_to_escape:
-            return True
-
-    if king_y == 0 or king_y == 10:
-        king_is_about_to_escape = True
-        for i in range(0, king_x):
-            if game_state[i][king_y] != 0:
-                king_is_about_to_escape = False
-        if king_is_about_to_escape:
-            return True
-        king_is_about_to_escape = True
-        for i in range(king_x + 1, 10):
-            if game_state[i][king_y] != 0:
-                king_is_about_to_escape = False
-        if king_is_about_to_escape:
-            return True
-
-    return False
+    """True if the king has a clear line along an edge to a corner.
+
+    See escape.king_can_escape_array.
+    """
+    return escape.king_can_escape_array(game_state)
 
 
 def main():
-    """Main function- initializes screen and starts new games."""
-    interactive = False
-    if interactive:
-        pygame.init()
-        screen = pygame.display.set_mode(tafl.WINDOW_SIZE)
-    else:
-        screen = None
-    tool.initialize_groups()
+    """Train the attackers' value network on self-play games.
 
-    num_train_games = 0
-    while num_train_games < 10:
-        num_train_games += 1
-        attacker_model = vn.HingstonNetwork()
-        result = run_game_cacd_RL(screen, attacker_model)
-        print(result)
-        tool.cleanup()
+    Games are played by a SelfPlayFarm on every core, learned from with
+    TD(lambda) and appended to GAMES_PATH. The model is saved to MODEL_PATH
+    after every round, so training resumes where it stopped.
+    """
+    attacker_model = vn.HingstonNetwork(fused=True)
+    trainer = td.TDTrainer(attacker_model)
+    if trainer.load(MODEL_PATH):
+        print("Resuming from {} after {} games".format(MODEL_PATH, trainer.games))
+    farm = selfplay.SelfPlayFarm()
+
+    with game_record.GameWriter(GAMES_PATH) as writer:
+        num_rounds = 0
+        while num_rounds < 10:
+            num_rounds += 1
+            results = []
+            loss = None
+            for moves, result in farm.play(attacker_model, farm.num_workers):
+                loss = trainer.add_game(selfplay.game_positions(moves), result)
+                writer.write(moves, result)
+                results.append(result)
+            print(results, loss)
+            writer.flush()
+            trainer.save(MODEL_PATH)
 
 
 def main1():
@@ -425,8 +334,13 @@ def main1():
     else:
         screen = None
     tool.initialize_groups()
-    attacker_model = vn.HingstonNetwork()
-    result = run_game_cacd_RL(screen, attacker_model)
+    attacker_model = vn.HingstonNetwork(fused=True)
+    trainer = td.TDTrainer(attacker_model)
+    trainer.load(MODEL_PATH)
+    # fast, fps or step; see pacing.make_pacer
+    pacer = pacing.make_pacer(sys.argv[1] if len(sys.argv) > 1 else "fps")
+    result = run_game_cacd_RL(screen, attacker_model, pacer, trainer)
+    trainer.save(MODEL_PATH)
     print(result)
     # print("Game finished in {} moves".format(len(a_corrected_scores) + len(d_corrected_scores)))
     tool.cleanup()
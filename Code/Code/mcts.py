@@ -0,0 +1,278 @@
+"""
+Monte Carlo tree search with HingstonNetwork leaf evaluation.
+
+A PUCT search over tafl_engine positions. HingstonNetwork has no policy
+head, so every move gets the same prior and the network only scores leaves.
+Simulations are run in groups: each one descends the tree with a virtual
+loss on its path so the next one of the group tries a different line, the
+leaves of the whole group are scored in one batched forward pass and the
+results are backed up together. The tree below the position that is reached
+is kept between moves. Leaf values can be mixed with the results of random
+playouts (see playout.py), played for the whole batch at once.
+
+MCTS.search has the signature of tafl_search.Searcher.search, so it can be
+passed to tools.do_search_move and the game loops.
+"""
+
+import math
+import random
+import sys
+import time
+import numpy as np
+import torch
+import tafl_engine as engine
+import agents
+import value_net as vn
+import playout
+
+
+class Node(object):
+    """A position in the tree, reached by move from its parent.
+
+    visits and value count the simulations through the node; value is the
+    sum of their results for the side that played move (sign 1 for the
+    attackers, -1 for the defenders).
+    """
+
+    __slots__ = ("parent", "move", "sign", "key", "children", "visits",
+                 "value", "prior", "terminal")
+
+    def __init__(self, parent, move, sign, prior):
+        self.parent = parent
+        self.move = move
+        self.sign = sign
+        self.prior = prior
+        self.key = None
+        self.children = None
+        self.visits = 0.0
+        self.value = 0.0
+        self.terminal = None
+
+
+def terminal_value(state):
+    """Result for the attackers of a finished game, None if not finished."""
+    if state.king_killed:
+        return 1.0
+    if state.escaped:
+        return -1.0
+    return None
+
+
+class MCTS(object):
+    """PUCT search with batched network evaluation and tree reuse."""
+
+    def __init__(self, model, simulations=800, batch_size=32, c_puct=1.5,
+                 virtual_loss=1.0, time_limit=None, rollouts=0,
+                 rollout_weight=0.5, rollout_plies=200, seed=None):
+        """Create a search.
+
+        Args:
+            model (HingstonNetwork): scores positions for the attackers
+            simulations (int): simulations per move
+            batch_size (int): leaves gathered per forward pass
+            c_puct (float): exploration constant
+            virtual_loss (float): visits added, as losses, along the path of
+                                  a simulation waiting for its evaluation
+            time_limit (float): seconds per move, None for no limit
+            rollouts (int): random playouts per leaf, 0 for none
+            rollout_weight (float): share of the playout result in a leaf's
+                                    value, the network has the rest
+            rollout_plies (int): playouts longer than this are draws
+            seed (int): seed of the playouts
+        """
+        self.model = model
+        self.simulations = simulations
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        self.virtual_loss = virtual_loss
+        self.time_limit = time_limit
+        self.root = None
+        self.batch = np.zeros((batch_size, 1, engine.DIM, engine.DIM),
+                              dtype=np.float32)
+        self.rollouts = rollouts
+        self.rollout_weight = rollout_weight
+        self.rollout_plies = rollout_plies
+        self.rollout_board = np.zeros((batch_size, playout.ROW), dtype=np.int8)
+        self.rollout_pieces = np.zeros((batch_size, playout.NUM_SLOTS),
+                                       dtype=np.intp)
+        self.rollout_turn = np.zeros(batch_size, dtype=bool)
+        self.rng = np.random.default_rng(seed)
+        self.simulations_done = 0
+        self.simulations_per_second = 0.0
+        self.forward_passes = 0
+
+    def search(self, state):
+        """Find the most visited move for the side to move.
+
+        Returns:
+            (move, score): the (from, to) move, or None when there is no
+                           legal move, and its mean value for the side to
+                           move, from -1 to 1.
+        """
+        root = self._find_root(state)
+        self.root = root
+        start = time.perf_counter()
+        deadline = None
+        if self.time_limit is not None:
+            deadline = start + self.time_limit
+        done = 0
+        passes = 0
+        while done < self.simulations:
+            done += self._run_batch(state, root,
+                                    min(self.batch_size,
+                                        self.simulations - done))
+            passes += 1
+            if root.terminal is not None:
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+        elapsed = time.perf_counter() - start
+        self.simulations_done = done
+        self.forward_passes = passes
+        self.simulations_per_second = done / max(elapsed, 1e-9)
+        if not root.children:
+            return None, 0.0
+        best = max(root.children, key=lambda c: c.visits)
+        if best.visits == 0:
+            return best.move, 0.0
+        return best.move, best.value / best.visits
+
+    def _find_root(self, state):
+        """Reuse the node of state if it is within two plies of the root."""
+        candidates = []
+        if self.root is not None:
+            candidates.append(self.root)
+            for child in self.root.children or ():
+                candidates.append(child)
+                candidates.extend(child.children or ())
+        for node in candidates:
+            if node.key == state.key:
+                node.parent = None
+                return node
+        root = Node(None, None, 1.0 if not state.a_turn else -1.0, 1.0)
+        root.key = state.key
+        return root
+
+    def _select(self, node):
+        c_sqrt = self.c_puct * math.sqrt(node.visits + 1)
+        best, best_score = None, -math.inf
+        for child in node.children:
+            if child.visits:
+                q = child.value / child.visits
+            else:
+                q = 0.0
+            score = q + c_sqrt * child.prior / (1.0 + child.visits)
+            if score > best_score:
+                best, best_score = child, score
+        return best
+
+    def _run_batch(self, state, root, count):
+        """Run up to count simulations and evaluate their leaves together.
+
+        Returns:
+            (int): simulations run
+        """
+        vl = self.virtual_loss
+        pending = []
+        done = 0
+        while done < count:
+            node = root
+            path = [root]
+            moves = []
+            while node.children:
+                node = self._select(node)
+                engine.apply(state, node.move)
+                moves.append(node.move)
+                path.append(node)
+            if node.key is None:
+                node.key = state.key
+            value = node.terminal
+            if value is None and node.children is None:
+                value = terminal_value(state)
+                if value is None:
+                    legal = engine.cached_moves(state)
+                    if legal:
+                        sign = 1.0 if state.a_turn else -1.0
+                        prior = 1.0 / len(legal)
+                        node.children = [Node(node, m, sign, prior)
+                                         for m in legal]
+                    else:
+                        # Nobody can move: the game loops call it a draw
+                        value = 0.0
+                node.terminal = value
+            leaf = None
+            if value is None:
+                # The leaf was just expanded, so the next simulations of the
+                # batch go past it instead of queueing it twice
+                leaf = len(pending)
+                agents.state_to_array(state, self.batch[leaf, 0])
+                if self.rollouts:
+                    playout.encode_into(state, self.rollout_board[leaf],
+                                        self.rollout_pieces[leaf])
+                    self.rollout_turn[leaf] = state.a_turn
+            self._undo(state, moves)
+            done += 1
+            if leaf is None:
+                self._backup(path, value, 0.0)
+                continue
+            for n in path:
+                n.visits += vl
+                n.value -= vl
+            pending.append((node, path))
+        if pending:
+            with torch.inference_mode():
+                out = self.model(torch.from_numpy(self.batch[:len(pending)]))
+            values = out.reshape(-1).clamp(-1.0, 1.0).numpy()
+            if self.rollouts:
+                n = len(pending)
+                played = playout.rollout_values(
+                    self.rollout_board[:n], self.rollout_pieces[:n],
+                    self.rollout_turn[:n], self.rollouts, self.rollout_plies,
+                    self.rng)
+                values = ((1.0 - self.rollout_weight) * values
+                          + self.rollout_weight * played)
+            values = values.tolist()
+            for (node, path), value in zip(pending, values):
+                self._backup(path, value, vl)
+        return done
+
+    @staticmethod
+    def _undo(state, moves):
+        for m in reversed(moves):
+            engine.undo(state, m)
+
+    @staticmethod
+    def _backup(path, value, vl):
+        """Add a result for the attackers to every node of path."""
+        for n in path:
+            n.visits += 1.0 - vl
+            n.value += n.sign * value + vl
+
+
+def main():
+    """Play MCTS attackers against random defenders and report sims/s."""
+    simulations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    torch.manual_seed(0)
+    model = vn.HingstonNetwork(fused=True)
+    model.eval()
+    player = MCTS(model, simulations=simulations)
+    rng = random.Random(0)
+    state = engine.initial_state()
+    rates = []
+    while not state.game_over and len(state.history) < 200:
+        if state.a_turn:
+            m, score = player.search(state)
+            rates.append(player.simulations_per_second)
+        else:
+            m = engine.random_move(state, rng)
+        if m is None:
+            break
+        engine.apply(state, m)
+    print("{} plies, king killed: {}, escaped: {}".format(
+        len(state.history), state.king_killed, state.escaped))
+    print("{:.0f} simulations/s ({} per move, batches of {})".format(
+        sum(rates) / max(len(rates), 1), simulations, player.batch_size))
+
+
+if __name__ == '__main__':
+    main()
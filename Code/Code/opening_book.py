@@ -0,0 +1,158 @@
+"""
+Opening book built from recorded games.
+
+The first plies of every game in a game_record file are replayed and the
+results are counted per position, keyed by the Zobrist key of
+tafl_engine.State (which includes the side to move). The table is a NumPy
+structured array sorted by key and saved as .npy, so at startup it is
+memory-mapped rather than read, and a position is found with a binary search.
+Computer players look the children of the current position up before
+searching and play the best scoring one that has been seen often enough.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import tafl_engine as engine
+import game_record
+
+BOOK_PATH = "opening_book.npy"
+BOOK_PLIES = 16
+MIN_GAMES = 8
+ENTRY = np.dtype([("key", "<u8"), ("attackers", "<u4"), ("draws", "<u4"),
+                  ("defenders", "<u4")])
+
+
+def build_book(records, max_plies=BOOK_PLIES):
+    """Count the results of every position in the first plies of games.
+
+    Args:
+        records (iterable(GameRecord)): games, e.g. game_record.read_games
+        max_plies (int): positions after this many plies are not counted
+
+    Returns:
+        table (np.ndarray): ENTRY array sorted by key, one row per position
+                            with the number of attacker wins, draws and
+                            defender wins of the games that reached it
+    """
+    keys = []
+    results = []
+    for record in records:
+        state = game_record.initial_state(record)
+        keys.append(state.key)
+        for m in record.moves[:max_plies]:
+            engine.apply(state, m)
+            keys.append(state.key)
+        results.extend([record.result] * (min(len(record.moves), max_plies)
+                                          + 1))
+    keys = np.array(keys, dtype=np.uint64)
+    results = np.array(results, dtype=np.int8)
+    unique, inverse = np.unique(keys, return_inverse=True)
+    table = np.zeros(len(unique), dtype=ENTRY)
+    table["key"] = unique
+    for field, result in (("attackers", 1), ("draws", 0), ("defenders", -1)):
+        table[field] = np.bincount(inverse[results == result],
+                                   minlength=len(unique))
+    return table
+
+
+def save_book(path, table):
+    """Write a table from build_book as a .npy file."""
+    np.save(path, table)
+
+
+def open_book(path=BOOK_PATH):
+    """Memory-map the book at path, or return None if there is none."""
+    if not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+class OpeningBook(object):
+    """Sorted, memory-mapped table of results per position."""
+
+    def __init__(self, path=BOOK_PATH, min_games=MIN_GAMES):
+        """Open a book.
+
+        Args:
+            path (str): .npy file written by save_book
+            min_games (int): fewest games a move needs to be played from
+                             the book
+        """
+        self.table = np.load(path, mmap_mode="r")
+        if self.table.dtype != ENTRY:
+            raise ValueError("{} is not an opening book".format(path))
+        self.keys = self.table["key"]
+        self.min_games = min_games
+
+    def __len__(self):
+        return len(self.table)
+
+    def stats(self, state):
+        """Results of the games through a position.
+
+        Returns:
+            (int, int, int): attacker wins, draws and defender wins, or None
+                             if the position is not in the book
+        """
+        key = np.uint64(state.key)
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        entry = self.table[i]
+        return (int(entry["attackers"]), int(entry["draws"]),
+                int(entry["defenders"]))
+
+    def score(self, stats, a_turn):
+        """Expected result of book stats for one side, from 0 to 1."""
+        attackers, draws, defenders = stats
+        wins = attackers if a_turn else defenders
+        return (wins + 0.5 * draws) / (attackers + draws + defenders)
+
+    def choose(self, state):
+        """Pick the book move with the best score for the side to move.
+
+        Only moves whose resulting position was reached in at least
+        min_games games are considered; more games break ties.
+
+        Returns:
+            (move, float): the (from, to) move and its score, or (None, None)
+                           when the position is out of the book
+        """
+        best_move, best = None, None
+        a_turn = state.a_turn
+        for m in engine.legal_moves(state):
+            engine.apply(state, m)
+            stats = self.stats(state)
+            engine.undo(state, m)
+            if stats is None or sum(stats) < self.min_games:
+                continue
+            rank = (self.score(stats, a_turn), sum(stats))
+            if best is None or rank > best:
+                best_move, best = m, rank
+        if best_move is None:
+            return None, None
+        return best_move, best[0]
+
+
+def main():
+    """Build a book: python opening_book.py GAMES [BOOK] [PLIES]."""
+    if len(sys.argv) < 2:
+        print("usage: python opening_book.py GAMES [BOOK] [PLIES]")
+        sys.exit(1)
+    path = sys.argv[2] if len(sys.argv) > 2 else BOOK_PATH
+    plies = int(sys.argv[3]) if len(sys.argv) > 3 else BOOK_PLIES
+    start = time.perf_counter()
+    table = build_book(game_record.read_games(sys.argv[1]), plies)
+    save_book(path, table)
+    print("{} positions written to {} in {:.1f}s".format(
+        len(table), path, time.perf_counter() - start))
+    book = OpeningBook(path)
+    state = engine.initial_state()
+    print("start: {}, book move: {}".format(book.stats(state),
+                                            book.choose(state)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Pacing policies for the game loops.
+
+A pacer is asked to wait once per ply. Training runs use Pacer, which does
+not wait at all; FixedRatePacer plays a fixed number of plies per second
+for watching a game, and KeypressPacer waits for a key before every ply so
+positions can be inspected one at a time.
+"""
+
+import sys
+import time
+import pygame
+from pygame.locals import *
+
+
+class Pacer(object):
+    """Play as fast as possible."""
+
+    def wait(self):
+        """Called once per ply, before the next move is chosen."""
+        pass
+
+
+class FixedRatePacer(Pacer):
+    """Play at most a fixed number of plies per second."""
+
+    def __init__(self, fps=2.0):
+        """Args:
+            fps (float): plies per second
+        """
+        self.period = 1.0 / fps
+        self.next_ply = None
+
+    def wait(self):
+        now = time.perf_counter()
+        if self.next_ply is not None and now < self.next_ply:
+            time.sleep(self.next_ply - now)
+            now = self.next_ply
+        self.next_ply = now + self.period
+
+
+class KeypressPacer(Pacer):
+    """Wait for a key press before every ply.
+
+    Needs a pygame window with the keyboard focus; closing the window exits.
+    """
+
+    def __init__(self, keys=(pygame.K_SPACE, pygame.K_RIGHT, pygame.K_n)):
+        """Args:
+            keys (tuple(int)): the keys that step to the next ply
+        """
+        self.keys = keys
+
+    def wait(self):
+        while 1:
+            event = pygame.event.wait()
+            if event.type == QUIT:
+                sys.exit()
+            if event.type == pygame.KEYDOWN and event.key in self.keys:
+                return
+
+
+def make_pacer(name, fps=2.0):
+    """Create a pacer from its name: 'fast', 'fps' or 'step'."""
+    if name == "fast":
+        return Pacer()
+    if name == "fps":
+        return FixedRatePacer(fps)
+    if name == "step":
+        return KeypressPacer()
+    raise ValueError("Unknown pacing '{}', use fast, fps or step".format(name))
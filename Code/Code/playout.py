@@ -0,0 +1,305 @@
+"""
+Vectorized random playouts.
+
+Plays many random games at once on compact NumPy arrays. Each game has an
+int8 board row of 121 squares plus an always-blocked square that rays and
+neighbours past the edge point to, and a row of piece squares. Cells hold
+the piece's slot + 1: slots 0-23 are attackers, 24-35 defenders and 36 the
+king, so a random piece is a random slot and a capture is found on the
+board and struck from the piece row without any search.
+
+Every ply draws a move for all the running games with a handful of array
+operations, applies captures, king kills and escapes with the tafl_engine
+rules, and drops the games that ended. Moves are drawn like
+tafl_engine.random_move: a piece uniformly among those that can move, then
+a destination uniformly. A side that cannot move ends the game in a draw,
+as the game loops would stall until their move limit.
+
+Used for rollouts in mcts.MCTS and for outcome and length statistics when
+the rules change (see main).
+"""
+
+import random
+import sys
+import time
+import numpy as np
+import tafl_engine as engine
+
+MAX_PLIES = 1000
+NUM_ATTACKERS = 24
+NUM_DEFENDERS = 12
+KING_SLOT = NUM_ATTACKERS + NUM_DEFENDERS
+NUM_SLOTS = KING_SLOT + 1
+KING = KING_SLOT + 1
+EMPTY, WALL, DEAD = 0, 127, -1
+OFF = engine.NUM_SQUARES
+ROW = OFF + 1
+
+
+def _build_tables():
+    rays = np.full((ROW, len(engine.DIRECTIONS), engine.DIM - 1), OFF,
+                   dtype=np.intp)
+    for sq in range(engine.NUM_SQUARES):
+        x, y = engine.coords(sq)
+        for d, (dx, dy) in enumerate(engine.DIRECTIONS):
+            for k in range(1, engine.DIM):
+                i, j = x + dx * k, y + dy * k
+                if not (0 <= i < engine.DIM and 0 <= j < engine.DIM):
+                    break
+                rays[sq, d, k - 1] = engine.square(i, j)
+    special = np.zeros(ROW, dtype=bool)
+    special[list(engine.iter_bits(engine.SPECIAL_MASK))] = True
+    corner = np.zeros(ROW, dtype=bool)
+    corner[list(engine.CORNERS)] = True
+    return rays, rays[:, :, 0].copy(), rays[:, :, 1].copy(), special, corner
+
+
+# RAYS[sq, d, k]: square k + 1 steps from sq in direction d, OFF past the
+# edge. ADJACENT and BEYOND are the first two steps (capture pairs).
+RAYS, ADJACENT, BEYOND, SPECIAL, CORNER = _build_tables()
+
+
+def _attackers(v):
+    return (v >= 1) & (v <= NUM_ATTACKERS)
+
+
+def _defenders(v):
+    return (v > NUM_ATTACKERS) & (v < KING)
+
+
+def encode(states):
+    """Turn tafl_engine States into playout arrays.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): boards [N, 122] int8, piece
+                                              squares [N, 37] (DEAD if
+                                              captured) and side to move [N]
+                                              (True for attackers)
+    """
+    board = np.zeros((len(states), ROW), dtype=np.int8)
+    pieces = np.zeros((len(states), NUM_SLOTS), dtype=np.intp)
+    a_turn = np.zeros(len(states), dtype=bool)
+    for i, state in enumerate(states):
+        encode_into(state, board[i], pieces[i])
+        a_turn[i] = state.a_turn
+    return board, pieces, a_turn
+
+
+def encode_into(state, row, pieces):
+    """Write one State into a [122] board row and a [37] piece row."""
+    row[:] = EMPTY
+    row[OFF] = WALL
+    pieces[:] = DEAD
+    for slot, sq in enumerate(engine.iter_bits(state.attackers)):
+        row[sq] = slot + 1
+        pieces[slot] = sq
+    for slot, sq in enumerate(engine.iter_bits(state.defenders),
+                              NUM_ATTACKERS):
+        row[sq] = slot + 1
+        pieces[slot] = sq
+    row[state.king_sq] = KING
+    pieces[KING_SLOT] = state.king_sq
+
+
+def _stops(board, games, frm):
+    """Destinations of the piece on frm in each game, as [n, 40] bools."""
+    ray = RAYS[frm]
+    clear = np.logical_and.accumulate(
+        board[games[:, None, None], ray] == EMPTY, axis=2)
+    is_king = board[games, frm] == KING
+    stops = clear & (~SPECIAL[ray] | is_king[:, None, None])
+    return stops.reshape(len(games), RAYS.shape[1] * RAYS.shape[2])
+
+
+def _choose(stops, rng):
+    """Column of a uniformly drawn True in each row (rows must have one)."""
+    # Rows have at most 40 entries, so int8 running counts are enough
+    running = np.cumsum(stops, axis=1, dtype=np.int8)
+    choice = (rng.random(len(stops)) * running[:, -1]).astype(np.int8)
+    return (running > choice[:, None]).argmax(axis=1)
+
+
+def _pick_moves(board, pieces, a_turn, rng):
+    """Draw a random move for every game.
+
+    A piece of the side to move is drawn among its live slots; pieces that
+    turn out to have no move are struck off and another one is drawn, which
+    keeps the choice uniform among the pieces that can move.
+
+    Returns:
+        (frm, to, stuck): source and destination squares, and a mask of the
+                          games whose side to move has no move at all
+    """
+    n = len(board)
+    slot_ids = np.arange(NUM_SLOTS)
+    first = np.where(a_turn, 0, NUM_ATTACKERS)[:, None]
+    last = np.where(a_turn, NUM_ATTACKERS, NUM_SLOTS)[:, None]
+    candidates = (slot_ids >= first) & (slot_ids < last) & (pieces != DEAD)
+    frm = np.zeros(n, dtype=np.intp)
+    to = np.zeros(n, dtype=np.intp)
+    stuck = np.zeros(n, dtype=bool)
+    todo = np.arange(n)
+    while todo.size:
+        left = candidates[todo]
+        empty = ~left.any(axis=1)
+        stuck[todo[empty]] = True
+        todo, left = todo[~empty], left[~empty]
+        slot = _choose(left, rng)
+        sq = pieces[todo, slot]
+        stops = _stops(board, todo, sq)
+        found = stops.any(axis=1)
+        # Pieces without a move are struck off and another one is drawn
+        candidates[todo[~found], slot[~found]] = False
+        games, sq, stops = todo[found], sq[found], stops[found]
+        frm[games] = sq
+        to[games] = RAYS[sq].reshape(len(games), stops.shape[1])[
+            np.arange(len(games)), _choose(stops, rng)]
+        todo = todo[~found]
+    return frm, to, stuck
+
+
+def _apply(board, pieces, a_turn, frm, to):
+    """Play one move per game in place.
+
+    Returns:
+        (np.ndarray): result per game, 1 king killed, -1 escaped, 0 going on
+    """
+    rows = np.arange(len(board))
+    piece = board[rows, frm]
+    board[rows, to] = piece
+    board[rows, frm] = EMPTY
+    pieces[rows, piece.astype(np.intp) - 1] = to
+
+    adjacent = ADJACENT[to]
+    beyond = BEYOND[to]
+    adjacent_v = board[rows[:, None], adjacent]
+    beyond_v = board[rows[:, None], beyond]
+    a_col = a_turn[:, None]
+    enemy = np.where(a_col, _defenders(adjacent_v), _attackers(adjacent_v))
+    friend = np.where(a_col, _attackers(beyond_v),
+                      _defenders(beyond_v) | (beyond_v == KING))
+    hostile = friend | (SPECIAL[beyond] & (beyond_v == EMPTY))
+    g, c = np.nonzero(enemy & hostile)
+    captured = adjacent[g, c]
+    pieces[g, board[g, captured].astype(np.intp) - 1] = DEAD
+    board[g, captured] = EMPTY
+
+    king = pieces[:, KING_SLOT]
+    result = np.zeros(len(board), dtype=np.int8)
+    result[(piece == KING) & CORNER[to]] = -1
+    near = a_turn & (adjacent == king[:, None]).any(axis=1)
+    if near.any():
+        around = ADJACENT[king[near]]
+        around_v = board[rows[near][:, None], around]
+        surrounded = ((around != OFF)
+                      & (_attackers(around_v) | SPECIAL[around])).all(axis=1)
+        result[rows[near][surrounded]] = 1
+    return result
+
+
+def play(board, pieces, a_turn, max_plies=MAX_PLIES, rng=None):
+    """Play random games from the given arrays to the end.
+
+    The arrays are not modified.
+
+    Args:
+        board, pieces, a_turn: as returned by encode
+        max_plies (int): plies after which a game is a draw
+        rng (np.random.Generator): source of the moves
+
+    Returns:
+        (np.ndarray, np.ndarray): results [N] int8 for the attackers (1 king
+                                  killed, -1 escaped, 0 draw) and lengths [N]
+                                  in plies
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    n = len(board)
+    results = np.zeros(n, dtype=np.int8)
+    lengths = np.full(n, max_plies, dtype=np.int32)
+    ids = np.arange(n)
+    board, pieces, a_turn = board.copy(), pieces.copy(), a_turn.copy()
+    for ply in range(max_plies):
+        if not ids.size:
+            break
+        frm, to, stuck = _pick_moves(board, pieces, a_turn, rng)
+        result = _apply(board, pieces, a_turn, frm, to)
+        # Moves drawn for stuck games are dummies; the games end here
+        result[stuck] = 0
+        ended = stuck | (result != 0)
+        results[ids[ended]] = result[ended]
+        lengths[ids[ended]] = ply + 1
+        lengths[ids[stuck]] = ply
+        keep = ~ended
+        ids, board, pieces, a_turn = (ids[keep], board[keep], pieces[keep],
+                                      ~a_turn[keep])
+    return results, lengths
+
+
+def random_games(num_games, max_plies=MAX_PLIES, seed=None):
+    """Play num_games random games from the starting position."""
+    board, pieces, a_turn = encode([engine.initial_state()])
+    return play(np.repeat(board, num_games, axis=0),
+                np.repeat(pieces, num_games, axis=0),
+                np.repeat(a_turn, num_games), max_plies,
+                np.random.default_rng(seed))
+
+
+def rollout_values(board, pieces, a_turn, rollouts, max_plies, rng=None):
+    """Mean result for the attackers of rollouts random games per position."""
+    results, lengths = play(np.repeat(board, rollouts, axis=0),
+                            np.repeat(pieces, rollouts, axis=0),
+                            np.repeat(a_turn, rollouts), max_plies, rng)
+    return results.reshape(-1, rollouts).mean(axis=1)
+
+
+def engine_games(num_games, max_plies=MAX_PLIES, seed=None):
+    """The same games played one by one with tafl_engine.random_move."""
+    rng = random.Random(seed)
+    results = np.zeros(num_games, dtype=np.int8)
+    lengths = np.full(num_games, max_plies, dtype=np.int32)
+    for i in range(num_games):
+        state = engine.initial_state()
+        for ply in range(max_plies):
+            m = engine.random_move(state, rng)
+            if m is None:
+                lengths[i] = ply
+                break
+            engine.apply(state, m)
+            if state.game_over:
+                results[i] = 1 if state.king_killed else -1
+                lengths[i] = ply + 1
+                break
+    return results, lengths
+
+
+def summary(results, lengths):
+    """Outcome and length distribution of a set of games."""
+    return {"games": len(results),
+            "attackers": int(np.count_nonzero(results == 1)),
+            "defenders": int(np.count_nonzero(results == -1)),
+            "draws": int(np.count_nonzero(results == 0)),
+            "mean_length": float(lengths.mean()),
+            "length_percentiles": np.percentile(lengths, [10, 50, 90]).tolist()}
+
+
+def main():
+    """Time the kernel and compare its statistics with tafl_engine games."""
+    num_games = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    start = time.perf_counter()
+    results, lengths = random_games(num_games, seed=0)
+    elapsed = time.perf_counter() - start
+    print("playout kernel: {:.0f} games/s, {:.0f} plies/s".format(
+        num_games / elapsed, lengths.sum() / elapsed))
+    print(summary(results, lengths))
+    num_games = max(num_games // 20, 1)
+    start = time.perf_counter()
+    results, lengths = engine_games(num_games, seed=0)
+    elapsed = time.perf_counter() - start
+    print("tafl_engine: {:.0f} games/s, {:.0f} plies/s".format(
+        num_games / elapsed, lengths.sum() / elapsed))
+    print(summary(results, lengths))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Cached drawing of the board, the pieces and the status text.
+
+The board never changes during a game, so it is drawn once into a
+background Surface, and each piece colour is drawn once into a small image.
+A frame then compares the pieces on the board with the ones drawn last
+time and only the tiles whose piece appeared, left or changed colour (a
+selection) are redrawn: the background is blitted back over the tile and
+the piece image on top. The status text is redrawn only when it changes,
+and only the changed rectangles are sent to the display.
+
+The font is loaded once and the status messages, a handful of strings that
+keep coming back, are rendered once each and kept in an LRU cache
+(TextCache), so showing a message is a single blit.
+"""
+
+import collections
+import pygame
+import hnefatafl as tafl
+
+TEXT_COLOR = (0, 0, 0)
+FONT_SIZE = 36
+TEXT_CACHE_SIZE = 32
+
+
+def tile_rect(x, y):
+    """Pixel rectangle of the tile in row x and column y."""
+    step = tafl.GSIZE + tafl.MARGIN
+    return pygame.Rect(x * step + tafl.MARGIN, y * step + tafl.MARGIN,
+                       tafl.GSIZE, tafl.GSIZE)
+
+
+def draw_background(board):
+    """Draw the margins and the tiles of board on a window sized Surface."""
+    background = pygame.Surface(tafl.WINDOW_SIZE)
+    background.fill(tafl.MARGIN_COLOR)
+    for y in range(board.dim):
+        for x in range(board.dim):
+            pygame.draw.rect(background, board.colors[board.grid[x][y]],
+                             tile_rect(x, y))
+    return background
+
+
+def draw_piece(color):
+    """Draw a piece of the given colour on a transparent tile sized Surface.
+
+    The circle is the one Piece.draw draws, moved to the tile's origin.
+    """
+    image = pygame.Surface((tafl.GSIZE, tafl.GSIZE), pygame.SRCALPHA)
+    pygame.draw.circle(image, color, [tafl.GSIZE // 2, tafl.GSIZE // 2],
+                       tafl.GSIZE // 2)
+    return image
+
+
+class TextCache(object):
+    """Rendered text surfaces keyed by message, with LRU eviction."""
+
+    def __init__(self, size=TEXT_CACHE_SIZE, font_size=FONT_SIZE,
+                 color=TEXT_COLOR):
+        """Create an empty cache; the font is loaded by load or first use.
+
+        Args:
+            size (int): most messages kept
+            font_size (int): size of pygame's default font
+            color ((int, int, int)): colour of the text
+        """
+        self.size = size
+        self.font_size = font_size
+        self.color = color
+        self.font = None
+        self.surfaces = collections.OrderedDict()
+
+    def load(self):
+        """Load the font once; pygame must be initialized."""
+        if self.font is None:
+            self.font = pygame.font.Font(None, self.font_size)
+        return self.font
+
+    def render(self, text):
+        """Return the Surface of text, rendering it only on a miss."""
+        surface = self.surfaces.get(text)
+        if surface is not None:
+            self.surfaces.move_to_end(text)
+            return surface
+        surface = self.load().render(text, 1, self.color)
+        self.surfaces[text] = surface
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+# Shared by every window, see Renderer
+TEXT = TextCache()
+
+
+class Renderer(object):
+    """Draws frames on a window, redrawing only what changed."""
+
+    def __init__(self, screen, board, text_cache=TEXT):
+        """Create a renderer for screen; nothing is drawn until draw.
+
+        Args:
+            screen (pygame.Surface): the game window
+            board (Board): the board whose tiles make the background
+            text_cache (TextCache): renders the status text
+        """
+        self.screen = screen
+        self.grid = tuple(board.grid)
+        self.background = draw_background(board)
+        self.text_cache = text_cache
+        text_cache.load()
+        self.images = {}
+        self.drawn = None
+        self.text = None
+        self.text_rect = None
+
+    def piece_image(self, color):
+        image = self.images.get(color)
+        if image is None:
+            image = draw_piece(color)
+            self.images[color] = image
+        return image
+
+    def invalidate(self):
+        """Redraw the whole window on the next draw."""
+        self.drawn = None
+
+    def draw(self, pieces, text):
+        """Bring the window up to date with pieces and the status text.
+
+        Args:
+            pieces (iterable(Piece)): every piece on the board
+            text (str): the text shown below the board
+        """
+        current = {}
+        for p in pieces:
+            current[(p.x_tile, p.y_tile)] = tuple(p.color)
+        if self.drawn is None:
+            self.screen.blit(self.background, (0, 0))
+            for (x, y), color in current.items():
+                self.screen.blit(self.piece_image(color), tile_rect(x, y))
+            self.drawn = current
+            self._draw_text(text)
+            pygame.display.flip()
+            return
+        dirty = []
+        for tile in set(self.drawn) | set(current):
+            color = current.get(tile)
+            if self.drawn.get(tile) == color:
+                continue
+            rect = tile_rect(*tile)
+            self.screen.blit(self.background, rect, rect)
+            if color is not None:
+                self.screen.blit(self.piece_image(color), rect)
+            dirty.append(rect)
+        self.drawn = current
+        if text != self.text:
+            if self.text_rect is not None:
+                self.screen.blit(self.background, self.text_rect,
+                                 self.text_rect)
+                dirty.append(self.text_rect)
+            self._draw_text(text)
+            dirty.append(self.text_rect)
+        if dirty:
+            pygame.display.update(dirty)
+
+    def _draw_text(self, text):
+        """Write which player's turn it is on the bottom of the window."""
+        msg = self.text_cache.render(text)
+        msgpos = msg.get_rect()
+        msgpos.centerx = self.screen.get_rect().centerx
+        msgpos.centery = ((tafl.HEIGHT - tafl.WIDTH) / 2) + tafl.WIDTH
+        self.screen.blit(msg, msgpos)
+        self.text = text
+        self.text_rect = msgpos
@@ -0,0 +1,157 @@
+"""
+Experience replay buffer for value network training.
+
+Positions are stored as int8 11x11 arrays (attackers 1, defenders -1, king
+-2), or packed at 2 bits per square, in a preallocated ring buffer together
+with a float32 target and a sampling priority. With a path the three arrays
+are memory-mapped .npy files, so the buffer can be larger than RAM and is
+picked up again by the next run.
+"""
+
+import os
+import numpy as np
+
+NUM_SQUARES = 121
+PACKED_BYTES = (NUM_SQUARES + 3) // 4
+
+
+def pack_positions(positions):
+    """Pack [N, 11, 11] boards with values in {-2, -1, 0, 1} to [N, 31] uint8."""
+    codes = (np.asarray(positions).reshape(-1, NUM_SQUARES) + 2).astype(np.uint8)
+    padded = np.zeros((codes.shape[0], PACKED_BYTES * 4), dtype=np.uint8)
+    padded[:, :NUM_SQUARES] = codes
+    quads = padded.reshape(-1, PACKED_BYTES, 4)
+    return (quads[:, :, 0] | (quads[:, :, 1] << 2) | (quads[:, :, 2] << 4)
+            | (quads[:, :, 3] << 6))
+
+
+def unpack_positions(packed):
+    """Inverse of pack_positions, returning [N, 11, 11] int8 boards."""
+    packed = np.asarray(packed, dtype=np.uint8)
+    quads = np.stack([(packed >> shift) & 3 for shift in (0, 2, 4, 6)], axis=2)
+    codes = quads.reshape(packed.shape[0], -1)[:, :NUM_SQUARES]
+    return (codes.astype(np.int8) - 2).reshape(-1, 11, 11)
+
+
+def _open(path, shape, dtype):
+    if os.path.exists(path):
+        arr = np.lib.format.open_memmap(path, mode="r+")
+        if arr.shape != shape or arr.dtype != dtype:
+            raise ValueError("{} holds {} {}, expected {} {}".format(
+                path, arr.shape, arr.dtype, shape, np.dtype(dtype)))
+        return arr
+    return np.lib.format.open_memmap(path, mode="w+", shape=shape, dtype=dtype)
+
+
+class ReplayBuffer(object):
+    """Ring buffer of (position, target) pairs with optional priorities."""
+
+    def __init__(self, capacity, path=None, packed=False, seed=None):
+        """Allocate the buffer.
+
+        Args:
+            capacity (int): number of positions kept; the oldest are
+                            overwritten once it is full
+            path (str): prefix of the memory-mapped files, None for RAM only
+            packed (bool): store 2 bits per square instead of one int8
+            seed (int): seed of the sampling generator
+        """
+        self.capacity = capacity
+        self.packed = packed
+        self.path = path
+        row = (PACKED_BYTES,) if packed else (11, 11)
+        dtype = np.uint8 if packed else np.int8
+        if path is None:
+            self.positions = np.zeros((capacity,) + row, dtype=dtype)
+            self.targets = np.zeros(capacity, dtype=np.float32)
+            self.priorities = np.zeros(capacity, dtype=np.float32)
+            self.meta = np.zeros(2, dtype=np.int64)
+        else:
+            self.positions = _open(path + ".positions.npy",
+                                   (capacity,) + row, dtype)
+            self.targets = _open(path + ".targets.npy", (capacity,),
+                                 np.float32)
+            self.priorities = _open(path + ".priorities.npy", (capacity,),
+                                    np.float32)
+            self.meta = _open(path + ".meta.npy", (2,), np.int64)
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return int(self.meta[0])
+
+    def add(self, positions, targets, priorities=None):
+        """Append positions and their targets, overwriting the oldest.
+
+        Args:
+            positions (np.ndarray): [N, 11, 11] (or a single 11x11) board
+            targets (np.ndarray): [N] target values
+            priorities (np.ndarray): [N] priorities, defaults to the current
+                                     maximum so new positions get sampled
+        """
+        positions = np.asarray(positions).reshape(-1, 11, 11)
+        targets = np.asarray(targets, dtype=np.float32).reshape(-1)
+        n = positions.shape[0]
+        if priorities is None:
+            top = self.priorities[:len(self)].max() if len(self) else 1.0
+            priorities = np.full(n, top, dtype=np.float32)
+        if n > self.capacity:
+            positions = positions[-self.capacity:]
+            targets = targets[-self.capacity:]
+            priorities = np.asarray(priorities)[-self.capacity:]
+            n = self.capacity
+        if self.packed:
+            rows = pack_positions(positions)
+        else:
+            rows = positions.astype(np.int8)
+        index = (self.meta[1] + np.arange(n)) % self.capacity
+        self.positions[index] = rows
+        self.targets[index] = targets
+        self.priorities[index] = priorities
+        self.meta[1] = (self.meta[1] + n) % self.capacity
+        self.meta[0] = min(self.capacity, self.meta[0] + n)
+
+    def get(self, index):
+        """Return (positions [B, 1, 11, 11] float32, targets [B]) at index."""
+        rows = self.positions[index]
+        if self.packed:
+            boards = unpack_positions(rows)
+        else:
+            boards = rows
+        boards = boards.astype(np.float32).reshape(-1, 1, 11, 11)
+        return boards, np.asarray(self.targets[index])
+
+    def sample(self, batch_size):
+        """Draw a uniform mini-batch.
+
+        Returns:
+            (np.ndarray, np.ndarray): positions [B, 1, 11, 11] and targets [B]
+        """
+        index = self.rng.integers(0, len(self), size=batch_size)
+        return self.get(index)
+
+    def sample_prioritized(self, batch_size, alpha=0.6, beta=0.4):
+        """Draw a mini-batch with probability proportional to priority**alpha.
+
+        Returns:
+            (positions, targets, index, weights): weights are the normalised
+            importance sampling corrections; pass index to update_priorities.
+        """
+        size = len(self)
+        scaled = np.power(self.priorities[:size].astype(np.float64) + 1e-6,
+                          alpha)
+        probs = scaled / scaled.sum()
+        index = self.rng.choice(size, size=batch_size, p=probs)
+        weights = np.power(size * probs[index], -beta)
+        weights /= weights.max()
+        positions, targets = self.get(index)
+        return positions, targets, index, weights.astype(np.float32)
+
+    def update_priorities(self, index, priorities):
+        """Set new priorities, usually the absolute TD errors of a batch."""
+        self.priorities[index] = np.abs(priorities)
+
+    def flush(self):
+        """Write memory-mapped arrays to disk."""
+        for arr in (self.positions, self.targets, self.priorities, self.meta):
+            if isinstance(arr, np.memmap):
+                arr.flush()
@@ -0,0 +1,191 @@
+"""
+Multi-process self-play for the reinforcement learning loop.
+
+Each worker process builds its own tafl_engine positions (no pygame sprites
+or module globals are involved), loads a private copy of the HingstonNetwork
+weights and streams every finished game back to the parent through a queue.
+The game is the one played by hnefatafl_train.run_game_cacd_RL: the
+attackers pick the move the value network likes best and the defenders move
+at random.
+"""
+
+import multiprocessing as mp
+import os
+import queue as queue_module
+import random
+import sys
+import time
+import traceback
+import numpy as np
+import torch
+import tafl_engine as engine
+import value_net as vn
+import agents
+import board_array
+
+MAX_MOVES = 1000
+# Seconds between checks that the workers are still alive
+POLL_TIME = 5.0
+
+
+def play_game(model, rng, max_moves=MAX_MOVES):
+    """Play one headless game.
+
+    Args:
+        model (HingstonNetwork): value network used by the attackers
+        rng (random.Random): source of the defenders' random moves
+        max_moves (int): number of plies after which the game is a draw
+
+    Returns:
+        (list((int, int)), int): the moves played and the result: 1 if the
+                                 attackers won, -1 if the defenders won, 0
+                                 for a draw (same as run_game_cacd_RL).
+    """
+    state = engine.initial_state()
+    moves = []
+    while len(moves) < max_moves:
+        if state.a_turn:
+            m = agents.value_move(state, model)
+        else:
+            m = engine.random_move(state, rng)
+        if m is None:
+            break
+        engine.apply(state, m)
+        moves.append(m)
+        if state.king_killed:
+            return moves, 1
+        if state.escaped:
+            return moves, -1
+    return moves, 0
+
+
+def game_positions(moves):
+    """Replay a game from the start.
+
+    Returns:
+        positions (np.ndarray): [len(moves) + 1, 11, 11] int8 boards, the
+                                starting position first
+    """
+    state = engine.initial_state()
+    board = board_array.ArrayBoard(state)
+    positions = np.empty((len(moves) + 1, engine.DIM, engine.DIM),
+                         dtype=np.int8)
+    positions[0] = board.cells
+    for i, m in enumerate(moves):
+        engine.apply(state, m)
+        board.push_last(state)
+        positions[i + 1] = board.cells
+    return positions
+
+
+def _worker(worker_id, state_dict, num_games, seed, max_moves, queue):
+    # Games are sent as (worker_id, record, None); the last message is
+    # (worker_id, None, error), error being the traceback if the worker failed
+    error = None
+    try:
+        # One thread per process, so that N workers use N cores
+        torch.set_num_threads(1)
+        model = vn.HingstonNetwork(fused=True)
+        model.load_state_dict(state_dict)
+        model.eval()
+        rng = random.Random(seed)
+        for _ in range(num_games):
+            queue.put((worker_id, play_game(model, rng, max_moves), None))
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        queue.put((worker_id, None, error))
+
+
+class SelfPlayFarm(object):
+    """Run self-play games on several processes."""
+
+    def __init__(self, num_workers=None, max_moves=MAX_MOVES, seed=0):
+        """Create a farm.
+
+        Args:
+            num_workers (int): worker processes, defaults to the CPU count
+            max_moves (int): plies after which a game is a draw
+            seed (int): base seed; worker i of run k uses a derived seed
+        """
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.max_moves = max_moves
+        self.seed = seed
+        self.runs = 0
+
+    def play(self, model, num_games):
+        """Play num_games with the current weights of model.
+
+        Workers receive a snapshot of the weights when they start, so the
+        caller may keep training model while games are streaming in.
+
+        Yields:
+            (list((int, int)), int): finished games, as returned by play_game,
+                                     in the order they complete.
+        """
+        state_dict = {k: v.detach().cpu().clone()
+                      for k, v in model.state_dict().items()}
+        ctx = mp.get_context("spawn")
+        queue = ctx.Queue()
+        workers = []
+        per_worker, extra = divmod(num_games, self.num_workers)
+        for i in range(self.num_workers):
+            games = per_worker + (1 if i < extra else 0)
+            if games == 0:
+                continue
+            seed = hash((self.seed, self.runs, i))
+            p = ctx.Process(target=_worker,
+                            args=(i, state_dict, games, seed, self.max_moves,
+                                  queue),
+                            daemon=True)
+            p.start()
+            workers.append(p)
+        self.runs += 1
+        running = len(workers)
+        try:
+            while running:
+                try:
+                    worker_id, record, error = queue.get(timeout=POLL_TIME)
+                except queue_module.Empty:
+                    # A worker killed outright (e.g. out of memory) never
+                    # sends its last message
+                    for i, p in enumerate(workers):
+                        if p.exitcode:
+                            raise RuntimeError(
+                                "self-play worker {} exited with code {}"
+                                .format(i, p.exitcode))
+                    continue
+                if error is not None:
+                    raise RuntimeError("self-play worker {} failed:\n{}"
+                                       .format(worker_id, error))
+                if record is None:
+                    running -= 1
+                else:
+                    yield record
+        finally:
+            for p in workers:
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+
+
+def main():
+    """Play a batch of games on every core and report the throughput."""
+    num_games = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    farm = SelfPlayFarm()
+    model = vn.HingstonNetwork(fused=True)
+    results = {1: 0, -1: 0, 0: 0}
+    plies = 0
+    start = time.perf_counter()
+    for moves, result in farm.play(model, num_games):
+        results[result] += 1
+        plies += len(moves)
+    elapsed = time.perf_counter() - start
+    print("{} games ({} plies) on {} workers in {:.1f}s: {:.2f} games/s".format(
+        num_games, plies, farm.num_workers, elapsed, num_games / elapsed))
+    print("attackers {} / defenders {} / draws {}".format(
+        results[1], results[-1], results[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+"""
+Retrograde endgame tablebases for positions with little material.
+
+A table covers every position with the king, a given number of attackers and
+a given number of defenders, for both sides to move, and stores one byte per
+position: 0 for a draw, n (1 to MAX_DEPTH) if the side to move wins in n
+plies, LOSS + n if it loses in n plies and ILLEGAL for impossible indices.
+Positions are indexed arithmetically, so a probe is a single array lookup:
+
+    index = ((side * 121 + king) * C(116, a) + rank(attackers))
+            * C(116, d) + rank(defenders)
+
+where side is 0 with the attackers to move, king is the king's square and
+rank is the colex rank of a set of squares among the 116 that are not the
+throne or a corner. Each table is saved as k<a>a<d>d.npy and memory-mapped by
+Tablebase.
+
+Tables are generated by retrograde analysis. A forward pass finds the moves
+that win at once (an escape or a king capture), looks the captures up in the
+smaller tables and counts the other moves of every position. Results then
+spread backwards one ply at a time: the predecessors of a lost position are
+won, and a position is lost once every one of its moves leads to a won one.
+Positions that are never resolved are draws, including the ones where the
+side to move has no legal move (the game loops stop at their move limit).
+
+The generator is plain Python; tables with up to two pieces besides the king
+take minutes to build. Three attackers are needed to capture the king, but
+those tables are too large for this generator.
+"""
+
+import array
+import itertools
+import os
+import sys
+import time
+import numpy as np
+import tafl_engine as engine
+
+TABLEBASE_DIR = "tablebases"
+SIGNATURES = ((0, 0), (1, 0), (0, 1), (2, 0), (1, 1), (0, 2))
+DRAW = 0
+LOSS = 128
+MAX_DEPTH = 126
+ILLEGAL = 255
+NO_LOSS = 0xFFFF
+
+PIECE_SQUARES = tuple(sq for sq in range(engine.NUM_SQUARES)
+                      if not engine.BIT[sq] & engine.SPECIAL_MASK)
+PIECE_INDEX = [-1] * engine.NUM_SQUARES
+for _i, _sq in enumerate(PIECE_SQUARES):
+    PIECE_INDEX[_sq] = _i
+NUM_PIECE_SQUARES = len(PIECE_SQUARES)
+BINOM = [[1] + [0] * 4 for _ in range(NUM_PIECE_SQUARES + 1)]
+for _n in range(1, NUM_PIECE_SQUARES + 1):
+    for _k in range(1, 5):
+        BINOM[_n][_k] = BINOM[_n - 1][_k - 1] + BINOM[_n - 1][_k]
+
+
+def decode(value):
+    """Turn a table byte into (result, plies) for the side to move.
+
+    result is 1 for a win, -1 for a loss and 0 for a draw.
+    """
+    if value == DRAW or value == ILLEGAL:
+        return 0, 0
+    if value > LOSS:
+        return -1, value - LOSS
+    return 1, value
+
+
+def rank(bb):
+    """Colex rank of a bitboard of pieces among PIECE_SQUARES."""
+    r = 0
+    k = 1
+    for sq in engine.iter_bits(bb):
+        r += BINOM[PIECE_INDEX[sq]][k]
+        k += 1
+    return r
+
+
+def table_name(signature):
+    return "k{}a{}d.npy".format(*signature)
+
+
+class Layout(object):
+    """Index arithmetic of the table of one material signature."""
+
+    def __init__(self, signature):
+        """Create the layout of (attackers, defenders) besides the king."""
+        self.signature = signature
+        num_a, num_d = signature
+        self.combos_a = self._combos(num_a)
+        self.combos_d = self._combos(num_d)
+        self.size_a = len(self.combos_a)
+        self.size_d = len(self.combos_d)
+        self.size = 2 * engine.NUM_SQUARES * self.size_a * self.size_d
+
+    @staticmethod
+    def _combos(k):
+        combos = [0] * BINOM[NUM_PIECE_SQUARES][k]
+        for squares in itertools.combinations(PIECE_SQUARES, k):
+            bb = 0
+            for sq in squares:
+                bb |= engine.BIT[sq]
+            combos[rank(bb)] = bb
+        return combos
+
+    def index(self, a_turn, king_sq, attackers, defenders):
+        side = 0 if a_turn else 1
+        return (((side * engine.NUM_SQUARES + king_sq) * self.size_a
+                 + rank(attackers)) * self.size_d + rank(defenders))
+
+    def position(self, i):
+        """Inverse of index: (a_turn, king_sq, attackers, defenders)."""
+        i, rd = divmod(i, self.size_d)
+        i, ra = divmod(i, self.size_a)
+        side, king_sq = divmod(i, engine.NUM_SQUARES)
+        return side == 0, king_sq, self.combos_a[ra], self.combos_d[rd]
+
+
+def _mover_pieces(a_turn, king_sq, attackers, defenders):
+    if a_turn:
+        return [(sq, False) for sq in engine.iter_bits(attackers)]
+    return ([(sq, False) for sq in engine.iter_bits(defenders)]
+            + [(king_sq, True)])
+
+
+def _after(a_turn, is_king, frm, to, king, attackers, defenders):
+    step = engine.BIT[frm] | engine.BIT[to]
+    if a_turn:
+        return king, attackers ^ step, defenders
+    if is_king:
+        return engine.BIT[to], attackers, defenders
+    return king, attackers, defenders ^ step
+
+
+class Generator(object):
+    """Build the table of one signature from the tables it captures into."""
+
+    def __init__(self, signature, subtables):
+        """Prepare a build.
+
+        Args:
+            signature ((int, int)): attackers and defenders besides the king
+            subtables (dict): signature -> (Layout, values) of every smaller
+                              signature a capture can lead to
+        """
+        self.layout = Layout(signature)
+        self.subtables = subtables
+        size = self.layout.size
+        self.values = bytearray([ILLEGAL]) * size
+        self.degree = array.array("H", [0]) * size
+        self.capture_depth = bytearray(size)
+        self.buckets = {}
+
+    def _bucket(self, depth, win):
+        if depth not in self.buckets:
+            self.buckets[depth] = ([], [])
+        return self.buckets[depth][0 if win else 1]
+
+    def _sub_value(self, a_turn, king, attackers, defenders):
+        layout, values = self.subtables[(engine.popcount(attackers),
+                                         engine.popcount(defenders))]
+        return values[layout.index(a_turn, king.bit_length() - 1, attackers,
+                                   defenders)]
+
+    def forward(self, i, a_turn, king_sq, attackers, defenders):
+        """Classify the moves of position i (the forward pass)."""
+        king = engine.BIT[king_sq]
+        occupied = attackers | defenders | king
+        win = None
+        longest = 0
+        degree = 0
+        drawn = False
+        moved = False
+        for frm, is_king in _mover_pieces(a_turn, king_sq, attackers,
+                                          defenders):
+            dest = engine.destinations(occupied, frm, is_king)
+            for to in engine.iter_bits(dest):
+                moved = True
+                if is_king and engine.BIT[to] & engine.CORNER_MASK:
+                    win = 1
+                    break
+                k2, a2, d2 = _after(a_turn, is_king, frm, to, king,
+                                    attackers, defenders)
+                captured, king_captured = engine.board_captures(
+                    a2, d2, k2, a_turn, to)
+                if king_captured:
+                    win = 1
+                    break
+                if not captured:
+                    degree += 1
+                    continue
+                result, plies = decode(self._sub_value(
+                    not a_turn, k2, a2 & ~captured, d2 & ~captured))
+                if result < 0:
+                    if win is None or plies + 1 < win:
+                        win = plies + 1
+                elif result > 0:
+                    longest = max(longest, plies)
+                else:
+                    drawn = True
+            if win == 1:
+                break
+        self.values[i] = DRAW
+        if win is not None:
+            self._bucket(win, True).append(i)
+        # A won position must not be counted down to a loss before its win
+        # bucket is reached, whatever its quiet moves lead to
+        if win is not None or not moved or drawn:
+            degree = NO_LOSS
+        elif degree == 0:
+            self._bucket(longest + 1, False).append(i)
+        self.degree[i] = degree
+        self.capture_depth[i] = longest
+
+    def predecessors(self, i):
+        """Positions with a non-capturing move to position i."""
+        layout = self.layout
+        a_turn, king_sq, attackers, defenders = layout.position(i)
+        mover = not a_turn
+        king = engine.BIT[king_sq]
+        occupied = attackers | defenders | king
+        for to, is_king in _mover_pieces(mover, king_sq, attackers,
+                                         defenders):
+            # A move onto to from anywhere would capture the same pieces
+            captured, king_captured = engine.board_captures(
+                attackers, defenders, king, mover, to)
+            if captured or king_captured:
+                continue
+            dest = engine.destinations(occupied, to, is_king)
+            if is_king:
+                dest &= ~engine.CORNER_MASK
+            for frm in engine.iter_bits(dest):
+                k2, a2, d2 = _after(mover, is_king, to, frm, king,
+                                    attackers, defenders)
+                yield layout.index(mover, k2.bit_length() - 1, a2, d2)
+
+    def run(self):
+        """Build the table.
+
+        Returns:
+            values (bytearray): one byte per index, see the module docstring
+        """
+        layout = self.layout
+        for side in (0, 1):
+            for king_sq in range(engine.NUM_SQUARES):
+                if engine.BIT[king_sq] & engine.CORNER_MASK:
+                    continue
+                king = engine.BIT[king_sq]
+                for attackers in layout.combos_a:
+                    if attackers & king:
+                        continue
+                    for defenders in layout.combos_d:
+                        if defenders & (attackers | king):
+                            continue
+                        i = layout.index(side == 0, king_sq, attackers,
+                                         defenders)
+                        self.forward(i, side == 0, king_sq, attackers,
+                                     defenders)
+        values, degree = self.values, self.degree
+        newly = []
+        for depth in range(1, MAX_DEPTH + 1):
+            assigned = []
+            wins, losses = self.buckets.pop(depth, ((), ()))
+            for i in wins:
+                if values[i] == DRAW:
+                    values[i] = depth
+                    assigned.append(i)
+            for i in losses:
+                if values[i] == DRAW:
+                    values[i] = LOSS + depth
+                    assigned.append(i)
+            for q in newly:
+                lost = values[q] > LOSS
+                for p in self.predecessors(q):
+                    if values[p] != DRAW:
+                        continue
+                    if lost:
+                        values[p] = depth
+                        assigned.append(p)
+                        continue
+                    degree[p] -= 1
+                    if degree[p] == 0:
+                        longest = self.capture_depth[p] + 1
+                        if longest <= depth:
+                            values[p] = LOSS + depth
+                            assigned.append(p)
+                        else:
+                            self._bucket(longest, False).append(p)
+            newly = assigned
+            if not newly and not self.buckets:
+                break
+        return values
+
+
+def build(directory=TABLEBASE_DIR, signatures=SIGNATURES, verbose=True):
+    """Generate and save tables, smallest first.
+
+    Tables already in directory are loaded instead of rebuilt. Every table a
+    capture leads to must be in signatures or already saved.
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    tables = Tablebase(directory).tables
+    for signature in sorted(signatures, key=sum):
+        if signature in tables:
+            continue
+        path = os.path.join(directory, table_name(signature))
+        start = time.perf_counter()
+        values = Generator(signature, tables).run()
+        table = np.frombuffer(bytes(values), dtype=np.uint8)
+        np.save(path, table)
+        tables[signature] = (Layout(signature), table)
+        if verbose:
+            won = np.count_nonzero((table > DRAW) & (table <= MAX_DEPTH))
+            lost = np.count_nonzero((table > LOSS) & (table < ILLEGAL))
+            print("{}: {} positions, {} won, {} lost, {:.1f}s".format(
+                table_name(signature), len(table), won, lost,
+                time.perf_counter() - start))
+    return tables
+
+
+def open_tablebase(directory=TABLEBASE_DIR):
+    """Open the tables in directory, or return None if there are none."""
+    if not os.path.isdir(directory):
+        return None
+    tablebase = Tablebase(directory)
+    if not tablebase.tables:
+        return None
+    return tablebase
+
+
+class Tablebase(object):
+    """Memory-mapped tables with a probe per position."""
+
+    def __init__(self, directory=TABLEBASE_DIR):
+        """Open every table saved in directory."""
+        self.tables = {}
+        for a in range(4):
+            for d in range(4):
+                path = os.path.join(directory, table_name((a, d)))
+                if os.path.exists(path):
+                    self.tables[(a, d)] = (Layout((a, d)),
+                                           np.load(path, mmap_mode="r"))
+
+    def covers(self, state):
+        """True if the material of state has a table."""
+        return (engine.popcount(state.attackers),
+                engine.popcount(state.defenders)) in self.tables
+
+    def probe(self, state):
+        """Look a position up.
+
+        Returns:
+            (int, int): result for the side to move (1 win, -1 loss, 0 draw)
+                        and plies to the end, or None if not covered
+        """
+        signature = (engine.popcount(state.attackers),
+                     engine.popcount(state.defenders))
+        if signature not in self.tables or state.game_over:
+            return None
+        layout, values = self.tables[signature]
+        return decode(int(values[layout.index(state.a_turn, state.king_sq,
+                                              state.attackers,
+                                              state.defenders)]))
+
+    def best_move(self, state):
+        """The fastest win, else a drawing move, else the slowest loss.
+
+        Returns:
+            move ((int, int)): the move, or None if the position is not
+                               covered or has no legal move
+        """
+        if self.probe(state) is None:
+            return None
+        best_move, best = None, None
+        for m in engine.legal_moves(state):
+            engine.apply(state, m)
+            if state.game_over:
+                rank_ = (1, 0)
+            else:
+                result, plies = self.probe(state)
+                # The child is scored for the opponent
+                rank_ = (-result, plies if result > 0 else -plies)
+            engine.undo(state, m)
+            if best is None or rank_ > best:
+                best_move, best = m, rank_
+        return best_move
+
+
+def main():
+    """Build the tables: python tablebase.py [DIRECTORY] [a,d ...]."""
+    directory = sys.argv[1] if len(sys.argv) > 1 else TABLEBASE_DIR
+    signatures = SIGNATURES
+    if len(sys.argv) > 2:
+        signatures = [tuple(int(n) for n in s.split(","))
+                      for s in sys.argv[2:]]
+    build(directory, signatures)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,555 @@
+"""
+Headless rules engine for Hnefatafl.
+
+The position is stored as three integer bitboards (attackers, defenders and
+the king) over the 11x11 board. Square (x, y) maps to bit x * 11 + y, which
+is the same x_tile/y_tile convention used by the sprites in hnefatafl.py,
+so moves can be passed back and forth between the engine and the pygame
+game without any conversion other than square()/coords().
+
+The rules are the ones implemented by hnefatafl.Move:
+    - every piece slides any distance along a rank or file until blocked;
+    - only the king may stop on the throne or a corner (others may pass
+      through the empty throne);
+    - a piece is captured when sandwiched between the mover and a friendly
+      piece or a hostile square (a corner, or the throne when it is empty);
+    - the king is captured when all four neighbours are attackers or
+      hostile squares (it can not be captured on the edge of the board);
+    - the defenders win when the king reaches a corner.
+"""
+
+import collections
+import random
+import time
+
+DIM = 11
+NUM_SQUARES = DIM * DIM
+START_GRID = ("x..aaaaa..x",
+              ".....a.....",
+              "...........",
+              "a....d....a",
+              "a...ddd...a",
+              "aa.ddcdd.aa",
+              "a...ddd...a",
+              "a....d....a",
+              "...........",
+              ".....a.....",
+              "x..aaaaa..x")
+
+
+def square(x, y):
+    """Return the bit index of tile (x, y)."""
+    return x * DIM + y
+
+
+def coords(sq):
+    """Return the (x, y) tile coordinates of a bit index."""
+    return divmod(sq, DIM)
+
+
+def iter_bits(bb):
+    """Yield the index of every set bit of a bitboard, lowest first."""
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def popcount(bb):
+    """Return the number of set bits of a bitboard."""
+    return bin(bb).count("1")
+
+
+BIT = tuple(1 << sq for sq in range(NUM_SQUARES))
+THRONE = square(5, 5)
+CORNERS = (square(0, 0), square(0, 10), square(10, 0), square(10, 10))
+THRONE_MASK = BIT[THRONE]
+CORNER_MASK = BIT[CORNERS[0]] | BIT[CORNERS[1]] | BIT[CORNERS[2]] | BIT[CORNERS[3]]
+SPECIAL_MASK = THRONE_MASK | CORNER_MASK
+
+# (dx, dy) for each direction. Even directions walk towards higher bit
+# indices, so the nearest blocker on their ray is the lowest set bit; odd
+# directions walk towards lower indices and the nearest is the highest bit.
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+def _build_tables():
+    rays = tuple([] for _ in DIRECTIONS)
+    neighbours = []
+    capture_pairs = []
+    for sq in range(NUM_SQUARES):
+        x, y = coords(sq)
+        adjacent = 0
+        pairs = []
+        for d, (dx, dy) in enumerate(DIRECTIONS):
+            mask = 0
+            i, j = x + dx, y + dy
+            while 0 <= i < DIM and 0 <= j < DIM:
+                mask |= BIT[square(i, j)]
+                i += dx
+                j += dy
+            rays[d].append(mask)
+            if 0 <= x + dx < DIM and 0 <= y + dy < DIM:
+                adjacent |= BIT[square(x + dx, y + dy)]
+                if 0 <= x + 2 * dx < DIM and 0 <= y + 2 * dy < DIM:
+                    pairs.append((BIT[square(x + dx, y + dy)],
+                                  BIT[square(x + 2 * dx, y + 2 * dy)]))
+        neighbours.append(adjacent)
+        capture_pairs.append(tuple(pairs))
+    return (tuple(tuple(r) for r in rays), tuple(neighbours),
+            tuple(capture_pairs))
+
+
+RAYS, NEIGHBOURS, CAPTURE_PAIRS = _build_tables()
+RAY_TABLES = tuple((RAYS[d], d % 2 == 0) for d in range(len(DIRECTIONS)))
+# The same neighbour and capture tables as square indices, for code that
+# looks pieces up in a dict by square instead of testing bitboards.
+NEIGHBOUR_SQUARES = tuple(tuple(iter_bits(bb)) for bb in NEIGHBOURS)
+CAPTURE_SQUARES = tuple(tuple((a.bit_length() - 1, f.bit_length() - 1)
+                              for a, f in pairs)
+                        for pairs in CAPTURE_PAIRS)
+SPECIAL_SQUARES = frozenset(iter_bits(SPECIAL_MASK))
+
+# Zobrist keys, indexed by piece kind then square. The seed is fixed so keys
+# are identical in every process and can be stored on disk.
+ATTACKER, DEFENDER, KING = 0, 1, 2
+_zobrist_rng = random.Random(0x7AF1)
+ZOBRIST = tuple(tuple(_zobrist_rng.getrandbits(64) for _ in range(NUM_SQUARES))
+                for _ in range(3))
+ZOBRIST_SIDE = _zobrist_rng.getrandbits(64)
+
+
+def zobrist_key(attackers, defenders, king, a_turn):
+    """Compute the Zobrist key of a position from scratch."""
+    key = 0 if a_turn else ZOBRIST_SIDE
+    for kind, bb in ((ATTACKER, attackers), (DEFENDER, defenders),
+                     (KING, king)):
+        for sq in iter_bits(bb):
+            key ^= ZOBRIST[kind][sq]
+    return key
+
+
+def destinations(occupied, sq, special_sqs=False):
+    """Find every square the piece on sq can slide to.
+
+    Args:
+        occupied (int): bitboard of all pieces on the board
+        sq (int): bit index of the piece to move
+        special_sqs (bool): True if the piece may stop on special squares
+
+    Returns:
+        (int): bitboard of destination squares
+    """
+    dest = 0
+    for rays, forward in RAY_TABLES:
+        ray = rays[sq]
+        blockers = ray & occupied
+        if blockers:
+            if forward:
+                b = (blockers & -blockers).bit_length() - 1
+            else:
+                b = blockers.bit_length() - 1
+            ray ^= rays[b] | BIT[b]
+        dest |= ray
+    if not special_sqs:
+        dest &= ~SPECIAL_MASK
+    return dest
+
+
+class State(object):
+    """A complete game position plus the history needed to undo moves.
+
+    The Zobrist key of the position is kept in key and updated by apply and
+    undo, so it never has to be recomputed during a search.
+    """
+
+    def __init__(self, attackers, defenders, king, a_turn=True):
+        """Create a position from bitboards.
+
+        Args:
+            attackers (int): bitboard of attacking pieces
+            defenders (int): bitboard of defending pieces, excluding the king
+            king (int): bitboard with the single bit of the king
+            a_turn (bool): True when it is the Attacker's turn
+        """
+        self.attackers = attackers
+        self.defenders = defenders
+        self.king = king
+        self.a_turn = a_turn
+        self.king_killed = False
+        self.escaped = False
+        self.history = []
+        self.key = zobrist_key(attackers, defenders, king, a_turn)
+
+    @property
+    def game_over(self):
+        return self.king_killed or self.escaped
+
+    @property
+    def occupied(self):
+        return self.attackers | self.defenders | self.king
+
+    @property
+    def king_sq(self):
+        return self.king.bit_length() - 1
+
+    def side_pieces(self):
+        """Return the bitboard of pieces belonging to the side to move."""
+        if self.a_turn:
+            return self.attackers
+        return self.defenders | self.king
+
+    def copy(self):
+        """Return an independent copy of the position (history included)."""
+        other = State(self.attackers, self.defenders, self.king, self.a_turn)
+        other.king_killed = self.king_killed
+        other.escaped = self.escaped
+        other.history = list(self.history)
+        other.key = self.key
+        return other
+
+    def __repr__(self):
+        rows = []
+        for x in range(DIM):
+            row = ""
+            for y in range(DIM):
+                b = BIT[square(x, y)]
+                if self.attackers & b:
+                    row += "a"
+                elif self.defenders & b:
+                    row += "d"
+                elif self.king & b:
+                    row += "c"
+                else:
+                    row += "."
+            rows.append(row)
+        return "\n".join(rows)
+
+
+def state_from_grid(grid, a_turn=True):
+    """Create a State from a Board.grid style list of strings."""
+    attackers = defenders = king = 0
+    for x in range(DIM):
+        for y in range(DIM):
+            b = BIT[square(x, y)]
+            if grid[x][y] == "a":
+                attackers |= b
+            elif grid[x][y] == "d":
+                defenders |= b
+            elif grid[x][y] == "c":
+                king |= b
+    return State(attackers, defenders, king, a_turn)
+
+
+def initial_state():
+    """Return the starting position, attackers to move."""
+    return state_from_grid(START_GRID)
+
+
+def piece_destinations(state, sq):
+    """Return the destination bitboard of the piece on sq."""
+    return destinations(state.occupied, sq, state.king == BIT[sq])
+
+
+def legal_moves(state):
+    """List every legal move for the side to move.
+
+    Returns:
+        moves (list((int, int))): (from, to) bit index pairs, empty if the
+                                  game is over.
+    """
+    if state.game_over:
+        return []
+    occupied = state.occupied
+    king = state.king
+    moves = []
+    for sq in iter_bits(state.side_pieces()):
+        for to in iter_bits(destinations(occupied, sq, king == BIT[sq])):
+            moves.append((sq, to))
+    return moves
+
+
+class MoveCache(object):
+    """Legal moves of recently seen positions, with LRU eviction.
+
+    Entries are keyed by the Zobrist key of the position and also hold its
+    occupancy, which is checked on every hit so a key collision can not
+    return the moves of another position. The moves are kept per piece as
+    well, so highlighting the destinations of one piece, drawing a random
+    move and scoring every move all share a single generation per ply.
+    The returned tuples and dicts are shared and must not be modified.
+    """
+
+    def __init__(self, size=4096):
+        """Create an empty cache holding at most size positions."""
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, state):
+        key = state.key
+        occupied = state.occupied
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == occupied:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        king = state.king
+        by_piece = {}
+        for sq in iter_bits(state.side_pieces()):
+            dest = destinations(occupied, sq, king == BIT[sq])
+            if dest:
+                by_piece[sq] = dest
+        # The move list is only built when somebody asks for it
+        entry = [occupied, by_piece, None]
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
+
+    def moves(self, state):
+        """Return the legal moves of state as a tuple, see legal_moves."""
+        if state.game_over:
+            return ()
+        entry = self._entry(state)
+        if entry[2] is None:
+            entry[2] = tuple((sq, to) for sq, dest in entry[1].items()
+                             for to in iter_bits(dest))
+        return entry[2]
+
+    def piece_moves(self, state):
+        """Return {square: destination bitboard} for the pieces that can move."""
+        if state.game_over:
+            return {}
+        return self._entry(state)[1]
+
+    def peek(self, state):
+        """Like piece_moves, but None when state is not cached (no update)."""
+        entry = self.entries.get(state.key)
+        if entry is None or entry[0] != state.occupied:
+            return None
+        if state.game_over:
+            return {}
+        return entry[1]
+
+    def destinations(self, state, sq):
+        """Return the destination bitboard of the piece on sq."""
+        return self.piece_moves(state).get(sq, 0)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Shared by the game loops, the agents and the random players
+MOVE_CACHE = MoveCache()
+
+
+def cached_moves(state):
+    """Return the legal moves of state from MOVE_CACHE (a shared tuple)."""
+    return MOVE_CACHE.moves(state)
+
+
+def random_move(state, rng=random):
+    """Pick a random piece of the side to move, then a random destination.
+
+    Pieces are drawn uniformly among those that can move, like the original
+    do_random_move which retried until it found one. If the moves of the
+    position are in MOVE_CACHE they are used; otherwise only the drawn pieces
+    are generated, which is much cheaper than the full list in random games
+    where positions hardly ever come back.
+
+    Returns:
+        move ((int, int)): a legal move, or None if there is none
+    """
+    if state.game_over:
+        return None
+    by_piece = MOVE_CACHE.peek(state)
+    if by_piece is not None:
+        if not by_piece:
+            return None
+        sq = rng.choice(list(by_piece))
+        return sq, rng.choice(list(iter_bits(by_piece[sq])))
+    pieces = list(iter_bits(state.side_pieces()))
+    while pieces:
+        sq = rng.choice(pieces)
+        dest = list(iter_bits(piece_destinations(state, sq)))
+        if len(dest) == 0:
+            pieces.remove(sq)
+            continue
+        return sq, rng.choice(dest)
+    return None
+
+
+def board_captures(attackers, defenders, king, a_turn, to):
+    """Find the captures of a piece that arrived on to, from bitboards.
+
+    The bitboards describe the board after the move; a_turn is the mover.
+    See captures for the State version.
+
+    Returns:
+        (int, bool): bitboard of captured soldiers, and whether the king was
+                     captured.
+    """
+    if a_turn:
+        enemies = defenders
+        friends = attackers
+    else:
+        enemies = attackers
+        friends = defenders | king
+    hostile = friends | (SPECIAL_MASK & ~king)
+    captured = 0
+    for adjacent, far in CAPTURE_PAIRS[to]:
+        if adjacent & enemies and far & hostile:
+            captured |= adjacent
+    king_captured = False
+    if a_turn and king & NEIGHBOURS[to]:
+        around = NEIGHBOURS[king.bit_length() - 1]
+        if popcount(around) == 4:
+            king_captured = not (around & ~(attackers | SPECIAL_MASK))
+    return captured, king_captured
+
+
+def captures(state, to):
+    """Find the pieces captured by the piece that just arrived on to.
+
+    Must be called after the mover has been placed but before the turn
+    passes, i.e. with state.a_turn still describing the mover.
+
+    Returns:
+        (int, bool): bitboard of captured soldiers, and whether the king was
+                     captured.
+    """
+    return board_captures(state.attackers, state.defenders, state.king,
+                     state.a_turn, to)
+
+
+def move_captures(state, move):
+    """Find what a move would capture without playing it.
+
+    Returns:
+        (int, bool): bitboard of captured soldiers, and whether the king
+                     would be captured.
+    """
+    frm, to = move
+    step = BIT[frm] | BIT[to]
+    attackers, defenders, king = state.attackers, state.defenders, state.king
+    if state.a_turn:
+        attackers ^= step
+    elif king == BIT[frm]:
+        king = BIT[to]
+    else:
+        defenders ^= step
+    return board_captures(attackers, defenders, king, state.a_turn, to)
+
+
+def apply(state, move):
+    """Play a move in place and push what is needed to undo it.
+
+    Args:
+        state (State): the position, modified in place
+        move ((int, int)): (from, to) bit indices of a legal move
+    """
+    frm, to = move
+    step = BIT[frm] | BIT[to]
+    if state.a_turn:
+        state.attackers ^= step
+        kind, enemy = ATTACKER, DEFENDER
+    elif state.king == BIT[frm]:
+        state.king = BIT[to]
+        kind, enemy = KING, ATTACKER
+    else:
+        state.defenders ^= step
+        kind, enemy = DEFENDER, ATTACKER
+    captured, king_captured = captures(state, to)
+    state.history.append((move, captured, state.king_killed, state.escaped,
+                          state.key))
+    key = state.key ^ ZOBRIST[kind][frm] ^ ZOBRIST[kind][to] ^ ZOBRIST_SIDE
+    if captured:
+        for sq in iter_bits(captured):
+            key ^= ZOBRIST[enemy][sq]
+        if state.a_turn:
+            state.defenders &= ~captured
+        else:
+            state.attackers &= ~captured
+    state.key = key
+    if king_captured:
+        state.king_killed = True
+    if state.king & CORNER_MASK:
+        state.escaped = True
+    state.a_turn = not state.a_turn
+
+
+def undo(state, move):
+    """Take back the last move played on state by apply.
+
+    Args:
+        state (State): the position, modified in place
+        move ((int, int)): the move being taken back, which must be the last
+                           one applied
+    """
+    (last, captured, state.king_killed, state.escaped,
+     state.key) = state.history.pop()
+    if last != move:
+        raise ValueError("undo({}) but the last move was {}".format(move, last))
+    state.a_turn = not state.a_turn
+    frm, to = move
+    step = BIT[frm] | BIT[to]
+    if state.a_turn:
+        state.attackers ^= step
+        state.defenders |= captured
+    elif state.king == BIT[to]:
+        state.king = BIT[frm]
+        state.attackers |= captured
+    else:
+        state.defenders ^= step
+        state.attackers |= captured
+
+
+def perft(state, depth):
+    """Count the leaf nodes of the legal move tree to the given depth.
+
+    Finished games are counted as leaves and not expanded further.
+    """
+    if depth == 0 or state.game_over:
+        return 1
+    moves = legal_moves(state)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for m in moves:
+        apply(state, m)
+        nodes += perft(state, depth - 1)
+        undo(state, m)
+    return nodes
+
+
+def divide(state, depth):
+    """Return perft(depth - 1) below each legal move, keyed by move."""
+    result = {}
+    for m in legal_moves(state):
+        apply(state, m)
+        result[m] = perft(state, depth - 1)
+        undo(state, m)
+    return result
+
+
+def main():
+    """Print perft counts and move generation speed from the start."""
+    state = initial_state()
+    for depth in range(1, 4):
+        start = time.perf_counter()
+        nodes = perft(state, depth)
+        elapsed = time.perf_counter() - start
+        print("perft({}) = {} in {:.3f}s ({:.0f} nodes/s)".format(
+            depth, nodes, elapsed, nodes / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+Alpha-beta search for Hnefatafl computer players.
+
+A negamax searcher with iterative deepening over tafl_engine positions. The
+leaves are scored by material and the king's distance to a corner in
+slides (distance_eval; simple_eval has the Manhattan distance of
+hnefatafl_train.Simple_heuristic), and each search is bounded by a time
+and/or node budget so it fits a fixed latency per move. Positions already
+searched are looked up in an optional transposition.TranspositionTable, and
+an optional opening_book.OpeningBook is consulted before searching at all.
+"""
+
+import time
+import tafl_engine as engine
+import transposition as tt
+import escape
+
+WIN_SCORE = 10000.0
+# Scores closer than this to WIN_SCORE are wins found at a known ply
+WIN_BOUND = WIN_SCORE - 1000
+NUM_ATTACKERS = 24
+NUM_DEFENDERS = 13
+# Slides counted for a king with no route to a corner, see distance_eval
+NO_ROUTE = 6
+ESCAPE_WEIGHT = 0.5
+
+
+def simple_eval(state):
+    """Score a position from the defenders' point of view.
+
+    Uses the terms of Simple_heuristic: material captured by each side and
+    the king's Manhattan distance to the nearest corner.
+    """
+    red_capture = NUM_ATTACKERS - engine.popcount(state.attackers)
+    white_capture = NUM_DEFENDERS - engine.popcount(state.defenders)
+    x, y = engine.coords(state.king_sq)
+    distance_to_burg = min(x + y, 20 - x - y, x + 10 - y, y + 10 - x)
+    return (red_capture - white_capture) + 0.1 * distance_to_burg
+
+
+def distance_eval(state):
+    """Score a position from the defenders' point of view.
+
+    Material as in simple_eval, but the king is scored by the slides it
+    really needs to reach a corner (escape.king_distance, blockers
+    included) instead of a Manhattan distance, and being closer is better
+    for the defenders. The default evaluation of Searcher; the field comes
+    from escape.DISTANCE_FIELDS, which updates the last field it looked up,
+    so the leaves of a search cost a partial search of the field each.
+    """
+    red_capture = NUM_ATTACKERS - engine.popcount(state.attackers)
+    white_capture = NUM_DEFENDERS - engine.popcount(state.defenders)
+    slides = escape.king_distance(state)
+    if slides is None or slides > NO_ROUTE:
+        slides = NO_ROUTE
+    return (red_capture - white_capture) + ESCAPE_WEIGHT * (NO_ROUTE - slides)
+
+
+def to_table(score, ply):
+    """Make a win score relative to the node before storing it."""
+    if score > WIN_BOUND:
+        return score + ply
+    if score < -WIN_BOUND:
+        return score - ply
+    return score
+
+
+def from_table(score, ply):
+    """Make a stored win score relative to the root again."""
+    if score > WIN_BOUND:
+        return score - ply
+    if score < -WIN_BOUND:
+        return score + ply
+    return score
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time or node budget runs out."""
+
+
+class Searcher(object):
+    """Negamax alpha-beta searcher with iterative deepening."""
+
+    def __init__(self, max_depth=4, time_limit=1.0, node_limit=None,
+                 evaluate=distance_eval, table=None, book=None):
+        """Create a searcher.
+
+        Args:
+            max_depth (int): deepest iteration to search
+            time_limit (float): seconds allowed per move, None for no limit
+            node_limit (int): nodes allowed per move, None for no limit
+            evaluate (function): State -> score for the defenders
+            table (TranspositionTable): shared table, None to search without
+            book (OpeningBook): played from while it has a move, None to
+                                always search
+        """
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.evaluate = evaluate
+        self.table = table
+        self.book = book
+        self.book_moves = 0
+        self.nodes = 0
+        self.depth = 0
+
+    def search(self, state):
+        """Find the best move for the side to move.
+
+        A move from the opening book is played without searching; its
+        score is the book's expected result mapped to [-1, 1] and depth is
+        left at 0. Otherwise every completed iteration replaces the best
+        move; an iteration interrupted by the budget is discarded, except
+        that depth 1 is always finished so a move is returned.
+
+        Returns:
+            (move, score): the best (from, to) move, or None when there is
+                           no legal move, and its score for the side to move.
+        """
+        self.nodes = 0
+        self.depth = 0
+        if self.book is not None:
+            move, score = self.book.choose(state)
+            if move is not None:
+                self.book_moves += 1
+                return move, 2 * score - 1
+        self.deadline = None
+        if self.time_limit is not None:
+            self.deadline = time.perf_counter() + self.time_limit
+        if self.table is not None:
+            self.table.new_search()
+        moves = self.order_moves(state, engine.legal_moves(state),
+                                 self.hash_move(state))
+        if not moves:
+            return None, -WIN_SCORE
+        best_move, best_score = moves[0], -WIN_SCORE
+        for depth in range(1, self.max_depth + 1):
+            try:
+                move, score = self.root(state, moves, depth, depth > 1)
+            except SearchTimeout:
+                break
+            best_move, best_score = move, score
+            self.depth = depth
+            if abs(score) >= WIN_SCORE - self.max_depth:
+                break
+            moves.remove(move)
+            moves.insert(0, move)
+        return best_move, best_score
+
+    def root(self, state, moves, depth, budgeted):
+        alpha, beta = -WIN_SCORE - 1, WIN_SCORE + 1
+        best_move = moves[0]
+        for m in moves:
+            engine.apply(state, m)
+            try:
+                score = -self.negamax(state, depth - 1, -beta, -alpha, 1,
+                                      budgeted)
+            finally:
+                engine.undo(state, m)
+            if score > alpha:
+                alpha = score
+                best_move = m
+        if self.table is not None:
+            self.table.store(state.key, depth, to_table(alpha, 0), tt.EXACT,
+                             best_move)
+        return best_move, alpha
+
+    def negamax(self, state, depth, alpha, beta, ply, budgeted=True):
+        self.nodes += 1
+        if budgeted and self.nodes & 1023 == 0:
+            self.check_budget()
+        if state.king_killed:
+            score = WIN_SCORE - ply
+            return -score if not state.a_turn else score
+        if state.escaped:
+            score = WIN_SCORE - ply
+            return score if not state.a_turn else -score
+        if not state.a_turn and escape.king_escape_moves(state) == 1:
+            # The king can slide to a corner now: a win without searching
+            return WIN_SCORE - ply - 1
+        if state.a_turn and escape.escape_routes(state) >= 2:
+            # Only a king on the edge sees a corner, and it can not be
+            # captured there; one move blocks one line, so it escapes next
+            return -(WIN_SCORE - ply - 2)
+        if depth == 0:
+            score = self.evaluate(state)
+            return -score if state.a_turn else score
+        hash_move = None
+        if self.table is not None:
+            entry = self.table.probe(state.key)
+            if entry is not None:
+                score, stored_depth, flag, hash_move = entry
+                if stored_depth >= depth:
+                    score = from_table(score, ply)
+                    if flag == tt.EXACT:
+                        return score
+                    if flag == tt.LOWER and score >= beta:
+                        return score
+                    if flag == tt.UPPER and score <= alpha:
+                        return score
+        moves = self.order_moves(state, engine.legal_moves(state), hash_move)
+        if not moves:
+            return -(WIN_SCORE - ply)
+        alpha_orig = alpha
+        best_move = None
+        for m in moves:
+            engine.apply(state, m)
+            try:
+                score = -self.negamax(state, depth - 1, -beta, -alpha,
+                                      ply + 1, budgeted)
+            finally:
+                engine.undo(state, m)
+            if score >= beta:
+                if self.table is not None:
+                    self.table.store(state.key, depth, to_table(score, ply),
+                                     tt.LOWER, m)
+                return score
+            if score > alpha:
+                alpha = score
+                best_move = m
+        if self.table is not None:
+            flag = tt.EXACT if alpha > alpha_orig else tt.UPPER
+            self.table.store(state.key, depth, to_table(alpha, ply), flag,
+                             best_move)
+        return alpha
+
+    def hash_move(self, state):
+        if self.table is None:
+            return None
+        entry = self.table.probe(state.key)
+        return None if entry is None else entry[3]
+
+    def check_budget(self):
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+
+    def order_moves(self, state, moves, hash_move=None):
+        """Sort moves so that the hash move, wins, captures and king moves come first."""
+        king = state.king
+        keyed = []
+        for m in moves:
+            if m == hash_move:
+                keyed.append((1000, m))
+                continue
+            key = 0
+            if king == engine.BIT[m[0]]:
+                key = 1
+                if engine.BIT[m[1]] & engine.CORNER_MASK:
+                    key = 100
+            captured, king_captured = engine.move_captures(state, m)
+            if king_captured:
+                key = 100
+            elif captured:
+                key += 10 * engine.popcount(captured)
+            keyed.append((key, m))
+        keyed.sort(key=lambda km: km[0], reverse=True)
+        return [m for _, m in keyed]
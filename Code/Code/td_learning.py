@@ -0,0 +1,155 @@
+"""
+Temporal-difference training of the attackers' value network.
+
+The trainer collects the positions of a game as it is played (or all at
+once from a self-play record), turns them into TD(lambda) targets when the
+game ends, stores them in a ReplayBuffer and fits the network on prioritized
+mini-batches. Values are from the attackers' point of view: +1 for a king
+capture, -1 for an escape and 0 for a draw, the same as run_game_cacd_RL.
+"""
+
+import os
+import numpy as np
+import torch
+import replay_buffer
+
+
+def lambda_returns(values, rewards, result, lam, gamma):
+    """Compute the offline lambda-return of every non-terminal position.
+
+    Args:
+        values (np.ndarray): [T] values of positions s_0 .. s_{T-1}
+        rewards (np.ndarray): [T] rewards r_1 .. r_T received after each one
+        result (float): value of the terminal position s_T
+        lam (float): trace decay lambda; 0 gives TD(0), 1 Monte Carlo
+        gamma (float): discount per ply
+
+    Returns:
+        targets (np.ndarray): [T] float32 lambda-returns
+    """
+    targets = np.zeros(len(values), dtype=np.float32)
+    next_value = next_return = result
+    for t in range(len(values) - 1, -1, -1):
+        next_return = rewards[t] + gamma * ((1 - lam) * next_value
+                                            + lam * next_return)
+        targets[t] = next_return
+        next_value = values[t]
+    return targets
+
+
+class TDTrainer(object):
+    """TD(lambda) learner with experience replay for HingstonNetwork."""
+
+    def __init__(self, model, lam=0.7, gamma=0.99, lr=1e-3, batch_size=128,
+                 train_steps=32, buffer=None):
+        """Create a trainer.
+
+        Args:
+            model (HingstonNetwork): the network to train, updated in place
+            lam (float): trace decay lambda
+            gamma (float): discount per ply
+            lr (float): Adam learning rate
+            batch_size (int): positions per mini-batch
+            train_steps (int): optimizer steps after each finished game
+            buffer (ReplayBuffer): defaults to 1,000,000 positions in RAM
+        """
+        self.model = model
+        self.lam = lam
+        self.gamma = gamma
+        self.batch_size = batch_size
+        self.train_steps = train_steps
+        self.optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+        if buffer is None:
+            buffer = replay_buffer.ReplayBuffer(1000000)
+        self.buffer = buffer
+        self.games = 0
+        self.steps = 0
+        self.positions = []
+        self.rewards = []
+
+    def observe(self, position, reward=0.0):
+        """Record the position reached by a ply and the reward it earned.
+
+        The first call of a game records the starting position; its reward
+        is ignored.
+        """
+        if self.positions:
+            self.rewards.append(reward)
+        self.positions.append(np.array(position, dtype=np.int8))
+
+    def end_game(self, result):
+        """Finish the game being observed and train on it.
+
+        Returns:
+            loss (float): mean loss of the training steps, None if none ran
+        """
+        positions, rewards = self.positions, self.rewards
+        self.positions, self.rewards = [], []
+        if len(positions) < 2:
+            return None
+        return self.add_game(np.stack(positions), result, rewards)
+
+    def add_game(self, positions, result, rewards=None):
+        """Add a whole game and train on the buffer.
+
+        Args:
+            positions (np.ndarray): [T + 1, 11, 11] boards from the start to
+                                    the final position
+            result (float): final result for the attackers
+            rewards (list(float)): [T] shaping rewards, zero by default
+
+        Returns:
+            loss (float): mean loss of the training steps, None if none ran
+        """
+        positions = np.asarray(positions)[:-1]
+        if rewards is None:
+            rewards = np.zeros(len(positions), dtype=np.float32)
+        values = self.predict(positions)
+        targets = lambda_returns(values, np.asarray(rewards, np.float32),
+                                 result, self.lam, self.gamma)
+        self.buffer.add(positions, targets, np.abs(targets - values))
+        self.games += 1
+        return self.train(self.train_steps)
+
+    def predict(self, positions):
+        """Value of [N, 11, 11] boards in one batched forward pass."""
+        x = torch.from_numpy(np.asarray(positions, dtype=np.float32))
+        with torch.inference_mode():
+            return self.model(x.reshape(-1, 1, 11, 11)).reshape(-1).numpy()
+
+    def train(self, steps):
+        """Run optimizer steps on prioritized mini-batches from the buffer."""
+        if len(self.buffer) < self.batch_size:
+            return None
+        total = 0.0
+        for _ in range(steps):
+            positions, targets, index, weights = \
+                self.buffer.sample_prioritized(self.batch_size)
+            values = self.model(torch.from_numpy(positions)).reshape(-1)
+            errors = values - torch.from_numpy(targets)
+            loss = (torch.from_numpy(weights) * errors * errors).mean()
+            self.optimizer.zero_grad()
+            loss.backward()
+            self.optimizer.step()
+            self.buffer.update_priorities(index, errors.detach().numpy())
+            total += loss.item()
+            self.steps += 1
+        return total / steps
+
+    def save(self, path):
+        """Save model and optimizer so training can resume across runs."""
+        torch.save({"model": self.model.state_dict(),
+                    "optimizer": self.optimizer.state_dict(),
+                    "games": self.games,
+                    "steps": self.steps}, path)
+
+    def load(self, path):
+        """Load a checkpoint written by save, if it exists."""
+        if not os.path.exists(path):
+            return False
+        checkpoint = torch.load(path)
+        self.model.load_state_dict(checkpoint["model"])
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+        self.games = checkpoint["games"]
+        self.steps = checkpoint["steps"]
+        return True
@@ -0,0 +1,37 @@
+"""
+Checks of the tablebase generator: python -m pytest test_tablebase.py
+"""
+
+import tablebase as tb
+import tafl_engine as engine
+
+
+def squares(*coords):
+    bb = 0
+    for x, y in coords:
+        bb |= engine.BIT[engine.square(x, y)]
+    return bb
+
+
+def build_tables(signatures):
+    tables = {}
+    for signature in signatures:
+        tables[signature] = (tb.Layout(signature),
+                             tb.Generator(signature, tables).run())
+    return tables
+
+
+def test_capture_win_is_never_counted_down_to_a_loss():
+    # The king slides from (0, 2) to (0, 8), takes the attacker on (0, 9)
+    # against the corner and escapes next move, a win in 3 that the forward
+    # pass finds through the (1, 0) table
+    tables = build_tables(((0, 0), (1, 0)))
+    generator = tb.Generator((2, 0), tables)
+    king_sq = engine.square(0, 2)
+    attackers = squares((0, 1), (0, 9))
+    i = generator.layout.index(False, king_sq, attackers, 0)
+    generator.forward(i, False, king_sq, attackers, 0)
+    wins = [depth for depth, (won, lost) in generator.buckets.items()
+            if i in won]
+    assert wins == [3]
+    assert generator.degree[i] == tb.NO_LOSS
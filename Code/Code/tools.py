@@ -12,7 +12,11 @@ Date: 3/15/2024
 
 import pygame
 import hnefatafl as tafl
-import random
+import tafl_engine as engine
+import render
+
+# The render.Renderer of the game window, see update_image
+renderer = None
 
 
 def initialize_groups():
@@ -74,96 +78,176 @@ def update_image(screen, board, text):
     """Update the image that the users see.
 
     Note:
-        Right now, it redraws the whole board every time it goes through this
-        function. In the future, it should only update the necessary tiles.
+        Drawing is done by a render.Renderer kept for the window: the board
+        and the pieces are pre-rendered, only the tiles changed since the
+        last call and the text, when it changes, are redrawn, and only those
+        rectangles are sent to the display. No display update is needed
+        after this function.
 
     Args:
         :param screen: the game window that the user interacts with
         :param board: the board that the pieces are on
         :param text: the text that is shown below the board
     """
-    screen.fill(tafl.MARGIN_COLOR)
-    for y in range(board.dim):
-        for x in range(board.dim):
-            xywh = [x * (tafl.GSIZE + tafl.MARGIN) + tafl.MARGIN,
-                    y * (tafl.GSIZE + tafl.MARGIN) + tafl.MARGIN,
-                    tafl.GSIZE,
-                    tafl.GSIZE]
-            pygame.draw.rect(screen, board.colors[board.grid[x][y]], xywh)
-
-    for piece in Pieces:
-        piece.draw(screen)
-
-    """Write which player's turn it is on the bottom of the window."""
-    font = pygame.font.Font(None, 36)
-    msg = font.render(text, 1, (0, 0, 0))
-    msgpos = msg.get_rect()
-    msgpos.centerx = screen.get_rect().centerx
-    msgpos.centery = ((tafl.HEIGHT - tafl.WIDTH) / 2) + tafl.WIDTH
-    screen.blit(msg, msgpos)
-
-    pygame.display.flip()
-
-
-def update_grid(board):
-    """Create all of the game pieces and put them in groups.
+    global renderer
+    if (renderer is None or renderer.screen is not screen
+            or renderer.grid != tuple(board.grid)):
+        renderer = render.Renderer(screen, board)
+    renderer.draw(Pieces, text)
 
-    Note:
-        The board layout from Board class is used for initial placement of
-        pieces.
+
+def engine_state(move):
+    """Return a headless copy of the current position.
+
+    The copy is taken from the position kept by Move.board_squares, so no
+    sprite is visited and the copy has the same Zobrist key, which lets it
+    share the moves in tafl_engine.MOVE_CACHE with the highlighting.
 
     Args:
-        board (Board): the game board object
+        move (Move): the current move state
+
+    Returns:
+        state (State): the headless copy of the current position
     """
-    for x in range(board.dim):
-        for y in range(board.dim):
-            l = list(board.grid[x])
-            if (x == 0 and y == 0) or (x == 10 and y == 0) or (x == 10 and y == 0) or (x == 10 and y == 0):
-                l[y] = "x"
-            else:
-                l[y] = "."
-            board.grid[x] = ''.join(l)
+    move.board_squares()
+    position = move.position
+    state = engine.State(position.attackers, position.defenders,
+                         position.king, position.a_turn)
+    state.king_killed = position.king_killed
+    state.escaped = position.escaped
+    return state
+
+
+def sprite_state(move):
+    """Build a tafl_engine.State from the sprite groups.
 
+    This is the reference for the position kept by Move (see check_rules).
+
+    Args:
+        move (Move): the current move state, used for the side to move
+
+    Returns:
+        state (State): the headless copy of the current position
+    """
+    attackers = defenders = king = 0
     for p in tafl.Attackers:
-        l = list(board.grid[p.x_tile])
-        l[p.y_tile] = "a"
-        board.grid[p.x_tile] = ''.join(l)
+        attackers |= engine.BIT[engine.square(p.x_tile, p.y_tile)]
     for p in tafl.Defenders:
-        l = list(board.grid[p.x_tile])
-        l[p.y_tile] = "d"
-        board.grid[p.x_tile] = ''.join(l)
+        defenders |= engine.BIT[engine.square(p.x_tile, p.y_tile)]
     for p in tafl.Kings:
-        l = list(board.grid[p.x_tile])
-        l[p.y_tile] = "c"
-        board.grid[p.x_tile] = ''.join(l)
+        king |= engine.BIT[engine.square(p.x_tile, p.y_tile)]
+    return engine.State(attackers, defenders & ~king, king, move.a_turn)
+
+
+def last_engine_move(move):
+    """Describe the last move finished with Move.complete_move in engine terms.
+
+    Returns:
+        ((int, int), int): the (from, to) bit indices and the bitboard of the
+                           pieces it captured
+    """
+    return _engine_move(move.history[-1])
+
+
+def _engine_move(record):
+    start, end, captured = record[1], record[-2], record[-1]
+    captured_bits = 0
+    for p, groups in captured:
+        captured_bits |= engine.BIT[engine.square(p.x_tile, p.y_tile)]
+    m = (engine.square(start[0], start[1]), engine.square(end[0], end[1]))
+    return m, captured_bits
+
+
+def record_moves(writer, move):
+    """Give a game_record.GameWriter the moves it has not seen yet.
+
+    Call it after a ply (or several) of a game loop; moves already recorded
+    for the game in progress are skipped, so plies where nobody moved add
+    nothing.
+
+    Args:
+        writer (GameWriter): the record of the game in progress
+        move (Move): the current move state
+    """
+    for record in move.history[writer.plies:]:
+        writer.record(_engine_move(record)[0])
+
+
+def piece_at(pieces, sq):
+    """Return the sprite of pieces standing on bit index sq, or None."""
+    x, y = engine.coords(sq)
+    for p in pieces:
+        if p.x_tile == x and p.y_tile == y:
+            return p
+    return None
+
+
+def play_engine_move(move, m):
+    """Play a (from, to) engine move on the sprites.
+
+    Args:
+        move (Move): the current move state
+        m ((int, int)): a legal move from tafl_engine.legal_moves
+    """
+    if move.a_turn:
+        piece = piece_at(tafl.Attackers, m[0])
+    else:
+        piece = piece_at(tafl.Defenders, m[0])
+    move.select(piece)
+    tafl.Current.add(piece)
+    if move.is_valid_move(engine.coords(m[1]), piece, True):
+        move.complete_move(piece)
+        tafl.Current.empty()
+    else:
+        raise ValueError("Engine move {} is not valid on the board".format(m))
 
 
 def do_random_move(move):
+    """Move a random piece of the side to move to a random valid square.
+
+    Pieces are drawn uniformly and, as before, pieces without a valid move
+    are skipped; the moves themselves come from tafl_engine.
+
+    Returns:
+        (bool): False if the side to move had no move, so none was played
+    """
+    m = engine.random_move(engine_state(move))
+    if m is None:
+        return False
+    play_engine_move(move, m)
+    return True
+
+
+def do_search_move(move, searcher):
+    """Play the move chosen by a tafl_search.Searcher for the side to move.
+
+    Args:
+        move (Move): the current move state
+        searcher (Searcher): the search to run within its own budget
+    """
+    best_move, score = searcher.search(engine_state(move))
+    if best_move is not None:
+        play_engine_move(move, best_move)
+
+
+def count_sprite_moves(move):
+    """Count the moves of the side to move with Move.sprite_valid_moves.
+
+    This is perft(1) computed by the original collision based move
+    generation, to be compared with tafl_engine.perft(engine_state(move), 1).
+    """
     if move.a_turn:
         pieces = tafl.Attackers
     else:
         pieces = tafl.Defenders
-    while 1:
-        piece = random.choice(pieces.sprites())
-        move.select(piece)
-        tafl.Current.add(piece)
-        if len(move.vm) == 0:
-            # print("No valid moves...")
-            move.select(piece)
-            tafl.Current.empty()
-            continue
-        else:
-            pos = random.choice(tuple(move.vm))
-            if move.is_valid_move(pos, tafl.Current.sprites()[0], True):
-                if tafl.Current.sprites()[0] in tafl.Kings:
-                    move.king_escaped(tafl.Kings)
-                if move.a_turn:
-                    move.remove_pieces(tafl.Defenders, tafl.Attackers, tafl.Kings)
-                else:
-                    move.remove_pieces(tafl.Attackers, tafl.Defenders, tafl.Kings)
-                move.end_turn(tafl.Current.sprites()[0])
-                tafl.Current.empty()
-            break
+    row, col = getattr(move, "row", None), getattr(move, "col", None)
+    nodes = 0
+    for piece in pieces:
+        move.row = piece.x_tile
+        move.col = piece.y_tile
+        nodes += len(move.sprite_valid_moves(piece.special_sqs))
+    move.row, move.col = row, col
+    return nodes
 
 
 def cleanup():
@@ -0,0 +1,113 @@
+"""
+Fixed-size transposition table for the search agents.
+
+Entries live in flat typed arrays sized from a memory budget in megabytes,
+so the table never grows during self-play. Each position maps to a single
+slot (key modulo the table size); a slot is overwritten when it is empty,
+was written by an earlier search (older age) or holds a shallower result.
+"""
+
+from array import array
+import tafl_engine as engine
+
+EXACT, LOWER, UPPER = 0, 1, 2
+NO_MOVE = 0xFFFF
+# Bytes used per entry: key (8), score (4), move (2), depth, flag and age (1)
+ENTRY_BYTES = 17
+
+
+class TranspositionTable(object):
+    """Bounded hash table of search results keyed by Zobrist key."""
+
+    def __init__(self, size_mb=16):
+        """Allocate the table.
+
+        Args:
+            size_mb (float): memory budget; the number of entries is the
+                             largest power of two that fits in it
+        """
+        budget = max(1, int(size_mb * 1024 * 1024) // ENTRY_BYTES)
+        self.size = 1 << (budget.bit_length() - 1)
+        self.mask = self.size - 1
+        self.keys = array('Q', [0]) * self.size
+        self.scores = array('f', [0.0]) * self.size
+        self.moves = array('H', [NO_MOVE]) * self.size
+        self.depths = array('b', [-1]) * self.size
+        self.flags = array('B', [EXACT]) * self.size
+        self.ages = array('B', [0]) * self.size
+        self.age = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+        self.rejected = 0
+
+    def new_search(self):
+        """Start a new search so entries from older searches are replaced first."""
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        for i in range(self.size):
+            self.depths[i] = -1
+        self.reset_stats()
+
+    def probe(self, key):
+        """Look up a position.
+
+        Returns:
+            (float, int, int, (int, int)): score, depth, bound flag and best
+                                           move (or None), or None if the
+                                           position is not stored.
+        """
+        self.probes += 1
+        i = key & self.mask
+        if self.depths[i] < 0 or self.keys[i] != key:
+            return None
+        self.hits += 1
+        code = self.moves[i]
+        move = None if code == NO_MOVE else divmod(code, engine.NUM_SQUARES)
+        return self.scores[i], self.depths[i], self.flags[i], move
+
+    def store(self, key, depth, score, flag, move=None):
+        """Save a search result, subject to the replacement policy."""
+        i = key & self.mask
+        stored = self.depths[i]
+        if stored >= 0 and self.ages[i] == self.age and depth < stored:
+            self.rejected += 1
+            return
+        if stored >= 0 and self.keys[i] != key:
+            self.overwrites += 1
+        self.stores += 1
+        self.keys[i] = key
+        self.scores[i] = score
+        self.depths[i] = min(depth, 127)
+        self.flags[i] = flag
+        self.ages[i] = self.age
+        if move is None:
+            self.moves[i] = NO_MOVE
+        else:
+            self.moves[i] = move[0] * engine.NUM_SQUARES + move[1]
+
+    @property
+    def hit_rate(self):
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+    def used(self):
+        """Return the fraction of slots holding an entry."""
+        return sum(1 for d in self.depths if d >= 0) / self.size
+
+    def stats(self):
+        """Return the counters as a dict, for logging table sizing runs."""
+        return {"size": self.size,
+                "size_mb": self.size * ENTRY_BYTES / (1024 * 1024),
+                "probes": self.probes,
+                "hits": self.hits,
+                "hit_rate": self.hit_rate,
+                "stores": self.stores,
+                "overwrites": self.overwrites,
+                "rejected": self.rejected}
@@ -1,9 +1,19 @@
+import time
 import torch
 import torch.nn as nn
 
+NUM_FEATURES = 99  # 9 horizontal strips + 9 vertical strips + 81 patches
+
+
 # Define the neural network architecture
 class HingstonNetwork(nn.Module):
-    def __init__(self):
+    def __init__(self, fused=False):
+        """Value network from the Hingston paper.
+
+        Args:
+            fused (bool): compute the three convolutions as a single matrix
+                          product over the flattened board (see forward)
+        """
         super(HingstonNetwork, self).__init__()
 
         self.conv1 = nn.Conv2d(in_channels=1, out_channels=1,
@@ -12,15 +22,86 @@ class HingstonNetwork(nn.Module):
                                kernel_size=(11, 3), stride=1, padding=0)
         self.conv3 = nn.Conv2d(in_channels=1, out_channels=1,
                                kernel_size=(3, 3), stride=1, padding=0)
-        self.fc1 = nn.Linear(99, 10)
+        self.fc1 = nn.Linear(NUM_FEATURES, 10)
         self.fc2 = nn.Linear(10, 1)
+        self.fused = fused
+        self._fused_cache = None
+
+    def features(self, x_grid):
+        # x_grid is [B, 1, 11, 11]; features are flattened per position
+        horizontal_strip = torch.flatten(self.conv1(x_grid), start_dim=1)
+        vertical_strip = torch.flatten(self.conv2(x_grid), start_dim=1)
+        patch3x3 = torch.flatten(self.conv3(x_grid), start_dim=1)
+        return torch.cat((horizontal_strip, vertical_strip, patch3x3), dim=1)
+
+    def fused_features(self):
+        """Return (weight [121, 99], bias [99]) equivalent to features().
+
+        The strips and patches are linear in the board, so running the
+        convolutions once over the 121 unit boards gives a single matrix.
+        Outside autograd the result is cached until a conv weight changes.
+        """
+        params = (self.conv1.weight, self.conv1.bias, self.conv2.weight,
+                  self.conv2.bias, self.conv3.weight, self.conv3.bias)
+        cacheable = not torch.is_grad_enabled()
+        versions = tuple(p._version for p in params)
+        if cacheable and self._fused_cache is not None:
+            if self._fused_cache[0] == versions:
+                return self._fused_cache[1]
+        ref = self.conv1.weight
+        bias = self.features(torch.zeros(1, 1, 11, 11, dtype=ref.dtype,
+                                         device=ref.device))
+        eye = torch.eye(121, dtype=ref.dtype, device=ref.device)
+        weight = self.features(eye.reshape(121, 1, 11, 11)) - bias
+        result = (weight, bias.reshape(-1))
+        if cacheable:
+            self._fused_cache = (versions, result)
+        return result
 
     def forward(self, x_grid):
-        horizontal_strip = torch.flatten(self.conv1(x_grid))
-        vertical_strip = torch.flatten(self.conv2(x_grid))
-        patch3x3 = torch.flatten(self.conv3(x_grid))
-        x = torch.cat((horizontal_strip, vertical_strip, patch3x3))
+        if x_grid.dim() == 3:
+            x_grid = x_grid.unsqueeze(1)
+        if self.fused:
+            weight, bias = self.fused_features()
+            x = torch.addmm(bias, x_grid.reshape(x_grid.shape[0], -1), weight)
+        else:
+            x = self.features(x_grid)
         x = self.fc1(x)
         x = self.fc2(x)
 
         return x
+
+
+def benchmark(model, batch_sizes=(1, 64, 1024), seconds=1.0):
+    """Measure forward passes on CPU.
+
+    Returns:
+        (dict): positions per second keyed by batch size
+    """
+    results = {}
+    model.eval()
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            x = torch.randint(-2, 2, (batch_size, 1, 11, 11)).float()
+            model(x)  # warm up, and build the fused weights
+            runs = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                model(x)
+                runs += 1
+            elapsed = time.perf_counter() - start
+            results[batch_size] = runs * batch_size / elapsed
+    return results
+
+
+def main():
+    torch.manual_seed(0)
+    for fused in (False, True):
+        results = benchmark(HingstonNetwork(fused=fused))
+        for batch_size, rate in results.items():
+            print("fused={} batch={}: {:.0f} positions/s".format(
+                fused, batch_size, rate))
+
+
+if __name__ == '__main__':
+    main()